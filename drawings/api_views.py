@@ -5,6 +5,7 @@ import logging
 from django.shortcuts import get_object_or_404
 from django.http import JsonResponse, HttpResponse
 from django.db import transaction
+from django.db.models import Count
 from rest_framework import generics, status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
@@ -18,7 +19,7 @@ from .serializers import (
     ImportBatchSerializer
 )
 from .services.pdf_processor import render_pdf_page, get_pdf_page_count
-from .services.csv_importer import import_assets_from_csv
+from .services.csv_importer import ImportInterruptedError, import_assets_from_csv
 from .services.export_service import export_sheet_with_overlays, generate_adjustment_report
 
 
@@ -217,6 +218,10 @@ def import_csv(request, project_pk):
             fixed_asset_type=fixed_asset_type,
         )
         return Response(result)
+    except ImportInterruptedError as e:
+        # Not a 400: part of the file was imported and the batch records it
+        logger.error("CSV import failed for project %d: %s", project_pk, e.__cause__)
+        return Response({'error': str(e), 'batch_id': e.batch.pk, **e.results}, status=500)
     except ValueError as e:
         logger.error("CSV import failed for project %d: %s", project_pk, e)
         return Response({'error': str(e)}, status=400)
@@ -237,9 +242,11 @@ def export_project(request, project_pk):
         sheets = project.sheets.filter(id__in=sheet_ids)
 
     try:
+        # Load the overlay assets once for every sheet rather than once per sheet
+        assets = list(project.assets.select_related('asset_type'))
         results = []
         for sheet in sheets:
-            output_path = export_sheet_with_overlays(sheet, project.assets.all())
+            output_path = export_sheet_with_overlays(sheet, assets)
             results.append({
                 'sheet_id': sheet.id,
                 'sheet_name': sheet.name,
@@ -258,8 +265,12 @@ def adjustment_report(request, project_pk):
     project = get_object_or_404(Project, pk=project_pk)
     format_type = request.query_params.get('format', 'json')
 
-    adjusted_assets = project.assets.filter(is_adjusted=True)
-    logs = AdjustmentLog.objects.filter(asset__project=project).order_by('-timestamp')
+    # Only the columns the report shows; asset metadata can be large
+    adjusted_assets = project.assets.filter(is_adjusted=True).only(
+        'project', 'asset_id', 'name', 'original_x', 'original_y', 'adjusted_x', 'adjusted_y', 'is_adjusted',
+    )
+    logs = (AdjustmentLog.objects.filter(asset__project=project)
+            .select_related('asset').defer('asset__metadata').order_by('-timestamp'))
 
     if format_type == 'csv':
         return generate_adjustment_report(project, adjusted_assets, logs, format_type='csv')
@@ -273,14 +284,15 @@ def adjustment_report(request, project_pk):
         'summary': []
     }
 
-    for asset in adjusted_assets:
+    # Log counts come from the database rather than loading every log per asset
+    for asset in adjusted_assets.annotate(log_count=Count('adjustment_logs')):
         report['summary'].append({
             'asset_id': asset.asset_id,
             'name': asset.name,
             'original': {'x': asset.original_x, 'y': asset.original_y},
             'adjusted': {'x': asset.adjusted_x, 'y': asset.adjusted_y},
             'delta_distance': asset.delta_distance,
-            'adjustment_count': asset.adjustment_logs.count()
+            'adjustment_count': asset.log_count
         })
 
     return Response(report)
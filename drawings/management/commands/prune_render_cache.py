@@ -0,0 +1,32 @@
+"""Trim the rendered-page cache to its most recently written entries."""
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from drawings.services.pdf_processor import CACHE_TMP_SUFFIX, RENDER_CACHE_DIR
+
+
+class Command(BaseCommand):
+    help = "Delete all but the newest cached page renders (run periodically, e.g. nightly)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep', type=int, default=500,
+            help="Number of most recently written renders to keep (default 500)",
+        )
+
+    def handle(self, *args, **options):
+        keep = max(options['keep'], 0)
+        if not default_storage.exists(RENDER_CACHE_DIR):
+            self.stdout.write("Render cache is empty.")
+            return
+
+        _, filenames = default_storage.listdir(RENDER_CACHE_DIR)
+        # Files still being written by a render are not entries yet
+        names = [f"{RENDER_CACHE_DIR}/{filename}" for filename in filenames
+                 if not filename.endswith(CACHE_TMP_SUFFIX)]
+        names.sort(key=default_storage.get_modified_time, reverse=True)
+
+        stale = names[keep:]
+        for name in stale:
+            default_storage.delete(name)
+        self.stdout.write(f"Removed {len(stale)} cached render(s), kept {len(names) - len(stale)}.")
@@ -9,15 +9,14 @@ def seed_asset_types(apps, schema_editor):
         ('VSL', 'square', '#0066FF', 20),
         ('CCTV', 'triangle', '#00AA00', 20),
     ]
-    for name, icon_shape, color, size in defaults:
-        AssetType.objects.get_or_create(
-            name=name,
-            defaults={
-                'icon_shape': icon_shape,
-                'color': color,
-                'size': size,
-            }
-        )
+    # Names are unique, so existing types are left untouched on re-runs
+    AssetType.objects.bulk_create(
+        [
+            AssetType(name=name, icon_shape=icon_shape, color=color, size=size)
+            for name, icon_shape, color, size in defaults
+        ],
+        ignore_conflicts=True,
+    )
 
 
 def remove_asset_types(apps, schema_editor):
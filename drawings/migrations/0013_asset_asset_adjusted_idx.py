@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-15 21:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drawings', '0012_alter_project_coord_unit'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(condition=models.Q(('is_adjusted', True)), fields=['project', 'is_adjusted'], name='asset_adjusted_idx'),
+        ),
+    ]
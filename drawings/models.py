@@ -201,6 +201,11 @@ class Asset(models.Model):
     class Meta:
         ordering = ['asset_id']
         unique_together = ['project', 'asset_id']
+        indexes = [
+            # Partial: only adjusted assets, which is all the adjustment report reads
+            models.Index(fields=['project', 'is_adjusted'], condition=models.Q(is_adjusted=True),
+                         name='asset_adjusted_idx'),
+        ]
 
     def __str__(self):
         return f"{self.asset_id} - {self.name}"
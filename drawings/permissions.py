@@ -13,6 +13,5 @@ class IsAuthenticatedOrDebug(BasePermission):
     """
 
     def has_permission(self, request, view):
-        if settings.DEBUG:
-            return True
-        return request.user and request.user.is_authenticated
+        # Read per request, not cached: the test runner assigns settings.DEBUG directly
+        return settings.DEBUG or bool(request.user and request.user.is_authenticated)
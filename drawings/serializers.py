@@ -42,6 +42,11 @@ class SheetSerializer(serializers.ModelSerializer):
                 pt = cut[key]
                 if not isinstance(pt, dict) or 'x' not in pt or 'y' not in pt:
                     raise serializers.ValidationError(f"cuts_json[{i}].{key} must have x and y")
+                # Checked once here so stored cuts can be used as numbers without coercion
+                for axis in ('x', 'y'):
+                    coord = pt[axis]
+                    if isinstance(coord, bool) or not isinstance(coord, (int, float)):
+                        raise serializers.ValidationError(f"cuts_json[{i}].{key}.{axis} must be a number")
         return value
 
     def get_rendered_image_url(self, obj):
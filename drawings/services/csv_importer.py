@@ -1,8 +1,14 @@
 """CSV import service for asset data."""
 import csv
 import io
+import json
 import logging
-from django.db import transaction
+import math
+from contextlib import contextmanager
+from operator import itemgetter
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
 from ..models import Asset, AssetType, ImportBatch
 
 logger = logging.getLogger(__name__)
@@ -16,6 +22,198 @@ DEFAULT_MAPPING = {
     'name': 'name',
 }
 
+# Number of assets written per bulk upsert; each upsert commits in its own
+# transaction so large imports never hold one long-running transaction open
+BATCH_SIZE = 1000
+
+# Read size for uploads already spooled to disk; large sequential reads keep
+# the number of read() syscalls low on multi-hundred-MB files
+READ_BUFFER_SIZE = 1 << 20
+
+# Row errors reported back in full; later errors are only counted so a badly
+# formatted file cannot grow the result without bound
+MAX_ERRORS = 100
+
+# Column limits checked per row, so a value the database would reject is
+# reported as a row error instead of failing the whole batch it is written in
+ASSET_ID_MAX_LENGTH = Asset._meta.get_field('asset_id').max_length
+ASSET_NAME_MAX_LENGTH = Asset._meta.get_field('name').max_length
+ASSET_TYPE_NAME_MAX_LENGTH = AssetType._meta.get_field('name').max_length
+
+# Asset fields refreshed when a re-imported asset_id already exists in the project
+UPSERT_FIELDS = ['asset_type', 'name', 'original_x', 'original_y', 'metadata', 'import_batch', 'updated_at']
+
+
+class ImportInterruptedError(Exception):
+    """
+    Raised when writing a batch fails after the import has started storing rows.
+
+    Field values the database would reject are caught earlier as row errors,
+    so this is left for failures of the database itself. Batches written
+    before the failure stay committed; `results` holds their counts and
+    `batch` the ImportBatch they belong to.
+    """
+
+    def __init__(self, batch, results):
+        self.batch = batch
+        self.results = results
+        stored = results['created'] + results['updated']
+        super().__init__(f"Import stopped after {stored} assets were stored (batch {batch.pk})")
+
+
+def _create_missing_asset_types(names, asset_types_cache):
+    """
+    Create asset types that are not yet in the cache with a single bulk INSERT.
+
+    The cache is keyed by lowercase name; the first spelling seen for a new
+    type is the one stored.
+    """
+    missing = {}
+    for name in names:
+        key = name.lower()
+        if key not in asset_types_cache:
+            missing.setdefault(key, name)
+    if not missing:
+        return
+    AssetType.objects.bulk_create(
+        [AssetType(name=name) for name in missing.values()],
+        ignore_conflicts=True,
+    )
+    for asset_type in AssetType.objects.filter(name__in=missing.values()):
+        asset_types_cache[asset_type.name.lower()] = asset_type
+
+
+def _upsert_assets(batch, pending, existing_pks, results):
+    """
+    Insert or update the pending assets in their own transaction and record the
+    outcome in results and on the import batch.
+
+    existing_pks maps the asset_ids already stored for the project to their
+    primary keys (None when not yet known) and is extended with the ones
+    created here.
+    """
+    if not pending:
+        return
+    try:
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                _copy_upsert_postgresql(pending)
+            elif connection.features.supports_update_conflicts_with_target:
+                Asset.objects.bulk_create(
+                    pending,
+                    batch_size=BATCH_SIZE,
+                    update_conflicts=True,
+                    unique_fields=['project', 'asset_id'],
+                    update_fields=UPSERT_FIELDS,
+                )
+            else:
+                _insert_and_update(pending, existing_pks)
+            # Commit progress with the rows so the batch reflects what has been imported
+            ImportBatch.objects.filter(pk=batch.pk).update(asset_count=F('asset_count') + len(pending))
+    except Exception as e:
+        # Earlier batches are already committed; report what was stored
+        raise ImportInterruptedError(batch, results) from e
+    for asset in pending:
+        created = asset.asset_id not in existing_pks
+        if created:
+            existing_pks[asset.asset_id] = asset.pk
+            results['created'] += 1
+        else:
+            results['updated'] += 1
+        results['assets'].append({
+            'asset_id': asset.asset_id,
+            'created': created,
+            'x': asset.original_x,
+            'y': asset.original_y
+        })
+    pending.clear()
+
+
+def _insert_and_update(pending, existing_pks):
+    """
+    Write the pending assets with bulk_create for new rows and bulk_update for
+    existing ones, for backends that cannot upsert on (project, asset_id).
+    """
+    to_create = [asset for asset in pending if asset.asset_id not in existing_pks]
+    to_update = [asset for asset in pending if asset.asset_id in existing_pks]
+    unknown_ids = [asset.asset_id for asset in to_update if existing_pks[asset.asset_id] is None]
+    if unknown_ids:
+        existing_pks.update(
+            Asset.objects.filter(
+                project_id=pending[0].project_id, asset_id__in=unknown_ids
+            ).values_list('asset_id', 'pk')
+        )
+    now = timezone.now()
+    for asset in to_update:
+        asset.pk = existing_pks[asset.asset_id]
+        asset.updated_at = now  # bulk_update does not apply auto_now
+    Asset.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+    Asset.objects.bulk_update(to_update, UPSERT_FIELDS, batch_size=BATCH_SIZE)
+
+
+def _copy_upsert_postgresql(pending):
+    """
+    Upsert assets on PostgreSQL by COPYing them into a temporary staging table
+    and merging that into the asset table with a single INSERT ... ON CONFLICT.
+
+    This skips per-row parameter binding and model-to-SQL conversion, which
+    dominate bulk_create on large imports. Metadata is staged as compact JSON
+    text and parsed into jsonb once by the merge. Must run inside a transaction.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for asset in pending:
+        writer.writerow([
+            asset.project_id, asset.asset_id, asset.asset_type_id, asset.name,
+            asset.original_x, asset.original_y,
+            json.dumps(asset.metadata, separators=(',', ':')), asset.import_batch_id,
+        ])
+    buffer.seek(0)
+
+    table = connection.ops.quote_name(Asset._meta.db_table)
+    with connection.cursor() as cursor:
+        # Dropped at commit; truncated after each use so later batches can reuse it
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS staging_asset ("
+            " project_id bigint, asset_id text, asset_type_id bigint, name text,"
+            " original_x double precision, original_y double precision,"
+            " metadata text, import_batch_id bigint"
+            ") ON COMMIT DROP"
+        )
+        _copy_from(
+            cursor,
+            "COPY staging_asset FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (asset_id, name))",
+            buffer,
+        )
+        # The asset table's indexes are left in place during the merge: the table is
+        # shared by every project, so dropping and rebuilding them would lock it and
+        # re-index all projects' rows to speed up one import. The staging table has
+        # no indexes, which is where the bulk of the rows are written.
+        cursor.execute(
+            f"INSERT INTO {table} ("
+            " project_id, asset_id, asset_type_id, name, original_x, original_y,"
+            " metadata, import_batch_id, is_adjusted, created_at, updated_at"
+            ") SELECT"
+            " project_id, asset_id, asset_type_id, name, original_x, original_y,"
+            " metadata::jsonb, import_batch_id, false, now(), now()"
+            " FROM staging_asset"
+            " ON CONFLICT (project_id, asset_id) DO UPDATE SET"
+            " asset_type_id = EXCLUDED.asset_type_id, name = EXCLUDED.name,"
+            " original_x = EXCLUDED.original_x, original_y = EXCLUDED.original_y,"
+            " metadata = EXCLUDED.metadata, import_batch_id = EXCLUDED.import_batch_id,"
+            " updated_at = EXCLUDED.updated_at"
+        )
+        cursor.execute("TRUNCATE staging_asset")
+
+
+def _copy_from(cursor, sql, buffer):
+    """Run a COPY ... FROM STDIN with either psycopg2 or psycopg 3."""
+    if hasattr(cursor, 'copy_expert'):
+        cursor.copy_expert(sql, buffer)
+    else:
+        with cursor.copy(sql) as copy:
+            copy.write(buffer.getvalue())
+
 
 def import_assets_from_csv(project, csv_file, column_mapping=None, filename=None, fixed_asset_type=None):
     """
@@ -33,144 +231,270 @@ def import_assets_from_csv(project, csv_file, column_mapping=None, filename=None
         dict with import results
     """
     mapping = {**DEFAULT_MAPPING, **(column_mapping or {})}
+    batch_filename = filename or getattr(csv_file, 'name', 'unknown.csv')
 
-    # Read the CSV content
-    content = csv_file.read()
-    if isinstance(content, bytes):
-        content = content.decode('utf-8-sig')  # Handle BOM if present
+    with _open_text_stream(csv_file) as stream:
+        return _import_rows(project, stream, mapping, batch_filename, fixed_asset_type)
 
-    reader = csv.DictReader(io.StringIO(content))
+
+@contextmanager
+def _open_text_stream(csv_file):
+    """
+    Yield the uploaded file as a text stream that is decoded as it is read,
+    so only a small buffer of the file is held in memory at once.
+    """
+    raw = getattr(csv_file, 'file', csv_file)
+    if isinstance(raw, io.TextIOBase):
+        yield raw
+        return
+    if hasattr(csv_file, 'temporary_file_path'):
+        # Large uploads are spooled to disk; read the file directly with a
+        # bigger buffer instead of through the upload's default 8KB one
+        with open(csv_file.temporary_file_path(), encoding='utf-8-sig', newline='',
+                  buffering=READ_BUFFER_SIZE) as stream:
+            yield stream
+        return
+    stream = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')  # Handle BOM if present
+    try:
+        yield stream
+    finally:
+        # Leave the upload open for the caller
+        stream.detach()
+
+
+def _parse_coordinates(x_str, y_str):
+    """Return (x, y) as floats, or None unless both are finite numbers."""
+    try:
+        x = float(x_str)
+        y = float(y_str)
+    except ValueError:
+        return None
+    # float() accepts 'nan' and 'inf', which the database stores as NULL or rejects
+    if not (math.isfinite(x) and math.isfinite(y)):
+        return None
+    return x, y
+
+
+def _accepted_type_names(reader, required_cells, i_type, i_name, width):
+    """
+    Return the asset type names used by rows that pass the row loop's
+    asset_id, coordinate and length checks, so rejected rows never create a type.
+
+    Every row is read, so the whole file is decoded by the time this returns.
+    With no type column (i_type is None) no names are collected.
+    """
+    names = {}
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < width:
+            row += [''] * (width - len(row))
+        asset_id, x_str, y_str = required_cells(row)
+        asset_id = asset_id.strip()
+        if not asset_id or len(asset_id) > ASSET_ID_MAX_LENGTH:
+            continue
+        if _parse_coordinates(x_str, y_str) is None:
+            continue
+        if i_name is not None and len(row[i_name].strip()) > ASSET_NAME_MAX_LENGTH:
+            continue
+        if i_type is not None:
+            type_name = row[i_type].strip()
+            if len(type_name) <= ASSET_TYPE_NAME_MAX_LENGTH:
+                names[type_name] = None
+    names.pop('', None)
+    return names
+
+
+def _import_rows(project, stream, mapping, batch_filename, fixed_asset_type):
+    """Validate the CSV header and import every row of the stream into the project."""
+    start = stream.tell()
+    reader = csv.reader(stream)
+    header = next(reader, [])
+    column_index = {column: i for i, column in enumerate(header)}
 
     # Validate that mapped columns exist in the CSV
-    fieldnames = reader.fieldnames
     required_roles = ['asset_id', 'x', 'y']
     if not fixed_asset_type:
         required_roles.append('asset_type')
     missing = []
     for role in required_roles:
         col = mapping.get(role, '')
-        if not col or col not in fieldnames:
+        if not col or col not in column_index:
             missing.append(f"{role} (mapped to '{col}')")
     if missing:
         raise ValueError(f"Missing columns in CSV: {', '.join(missing)}")
 
-    # Build set of mapped column names to exclude from metadata
+    # Resolve column positions once so the row loop indexes plain lists
+    col_id = mapping['asset_id']
+    col_type = mapping.get('asset_type', '') if not fixed_asset_type else ''
+    col_x = mapping['x']
+    col_y = mapping['y']
+    col_name = mapping.get('name', '')
+    i_id = column_index[col_id]
+    i_type = column_index[col_type] if col_type else None
+    i_x = column_index[col_x]
+    i_y = column_index[col_y]
+    i_name = column_index.get(col_name) if col_name else None
+    width = len(header)
+    # Fetches the three required cells of a row in one C-level call
+    required_cells = itemgetter(i_id, i_x, i_y)
+
+    # Extra columns (not mapped to any role) are kept as metadata
     mapped_columns = set(mapping.values())
+    extra_columns = tuple((column, i) for column, i in column_index.items() if column not in mapped_columns)
+    # Everything below works from the resolved positions only
+    del mapping, mapped_columns, column_index
 
-    # Get or create asset types
+    # Load existing asset types keyed by lowercase name
     asset_types_cache = {at.name.lower(): at for at in AssetType.objects.all()}
 
     results = {
         'created': 0,
         'updated': 0,
         'errors': [],
+        'errors_truncated': 0,
         'assets': []
     }
+    errors = results['errors']
+    error_overflow = 0
 
-    col_id = mapping['asset_id']
-    col_type = mapping.get('asset_type', '') if not fixed_asset_type else ''
-    col_x = mapping['x']
-    col_y = mapping['y']
-    col_name = mapping.get('name', '')
+    # Read the whole file before anything is written. Batches commit one at a
+    # time, so a decoding or CSV error must surface here rather than after some
+    # rows are already stored. The pass also collects the asset types to create
+    # up front, so the row loop only hits the cache
+    stream.seek(start)
+    reader = csv.reader(stream)
+    next(reader, None)
+    type_names = _accepted_type_names(reader, required_cells, i_type, i_name, width)
+    stream.seek(start)
+    reader = csv.reader(stream)
+    next(reader, None)
 
-    # Resolve fixed asset type once if provided
     fixed_type_obj = None
     if fixed_asset_type:
-        fixed_key = fixed_asset_type.lower()
-        if fixed_key not in asset_types_cache:
-            fixed_type_obj = AssetType.objects.create(name=fixed_asset_type)
-            asset_types_cache[fixed_key] = fixed_type_obj
-        else:
-            fixed_type_obj = asset_types_cache[fixed_key]
+        _create_missing_asset_types([fixed_asset_type], asset_types_cache)
+        fixed_type_obj = asset_types_cache[fixed_asset_type.lower()]
+    else:
+        _create_missing_asset_types(type_names, asset_types_cache)
 
-    with transaction.atomic():
-        # Create import batch for tracking
-        batch_filename = filename or getattr(csv_file, 'name', 'unknown.csv')
-        batch = ImportBatch.objects.create(
-            project=project,
-            filename=batch_filename,
-            asset_count=0
-        )
+    # Create import batch for tracking
+    batch = ImportBatch.objects.create(
+        project=project,
+        filename=batch_filename,
+        asset_count=0
+    )
+
+    # One query up front tells created from updated rows without a lookup per row
+    existing_pks = dict(Asset.objects.filter(project=project).values_list('asset_id', 'pk'))
+    pending = []
+    pending_ids = set()
+    types_by_value = {}
+
+    for row_num, row in enumerate(reader, start=2):  # Start at 2 (1-indexed + header)
+        if not row:
+            continue  # Blank line
+        if len(row) < width:
+            row += [''] * (width - len(row))
+        try:
+            # Extract fields by resolved column position
+            asset_id, x_str, y_str = required_cells(row)
+            asset_id = asset_id.strip()
+            x_str = x_str.strip()
+            y_str = y_str.strip()
 
-        for row_num, row in enumerate(reader, start=2):  # Start at 2 (1-indexed + header)
-            try:
-                # Extract fields using mapped column names
-                asset_id = row.get(col_id, '').strip()
-                x_str = row.get(col_x, '').strip()
-                y_str = row.get(col_y, '').strip()
-
-                if not asset_id:
-                    results['errors'].append(f"Row {row_num}: Missing asset_id (column '{col_id}')")
-                    continue
-
-                # Parse coordinates
-                try:
-                    x = float(x_str)
-                    y = float(y_str)
-                except ValueError:
-                    results['errors'].append(f"Row {row_num}: Invalid coordinates ({col_x}={x_str}, {col_y}={y_str})")
-                    continue
-
-                # Resolve asset type
-                if fixed_type_obj:
-                    asset_type = fixed_type_obj
+            if not asset_id:
+                if len(errors) < MAX_ERRORS:
+                    errors.append(f"Row {row_num}: Missing asset_id (column '{col_id}')")
                 else:
-                    asset_type_name = row.get(col_type, '').strip()
+                    error_overflow += 1
+                continue
+            if len(asset_id) > ASSET_ID_MAX_LENGTH:
+                if len(errors) < MAX_ERRORS:
+                    errors.append(f"Row {row_num}: asset_id longer than {ASSET_ID_MAX_LENGTH} characters")
+                else:
+                    error_overflow += 1
+                continue
+
+            # Parse coordinates
+            coordinates = _parse_coordinates(x_str, y_str)
+            if coordinates is None:
+                if len(errors) < MAX_ERRORS:
+                    errors.append(f"Row {row_num}: Invalid coordinates ({col_x}={x_str}, {col_y}={y_str})")
+                else:
+                    error_overflow += 1
+                continue
+            x, y = coordinates
+
+            # Get optional name
+            name = row[i_name].strip() if i_name is not None else ''
+            if len(name) > ASSET_NAME_MAX_LENGTH:
+                if len(errors) < MAX_ERRORS:
+                    errors.append(f"Row {row_num}: name longer than {ASSET_NAME_MAX_LENGTH} characters")
+                else:
+                    error_overflow += 1
+                continue
+
+            # Resolve asset type
+            if fixed_type_obj:
+                asset_type = fixed_type_obj
+            else:
+                # Type columns repeat a handful of values, so normalise each distinct one once
+                raw_type = row[i_type]
+                asset_type = types_by_value.get(raw_type)
+                if asset_type is None:
+                    asset_type_name = raw_type.strip()
                     if not asset_type_name:
-                        results['errors'].append(f"Row {row_num}: Missing asset_type (column '{col_type}')")
+                        if len(errors) < MAX_ERRORS:
+                            errors.append(f"Row {row_num}: Missing asset_type (column '{col_type}')")
+                        else:
+                            error_overflow += 1
                         continue
-                    asset_type_key = asset_type_name.lower()
-                    if asset_type_key not in asset_types_cache:
-                        asset_type = AssetType.objects.create(name=asset_type_name)
-                        asset_types_cache[asset_type_key] = asset_type
-                    else:
-                        asset_type = asset_types_cache[asset_type_key]
-
-                # Build metadata from extra columns (not mapped to any role)
-                metadata = {}
-                for key, value in row.items():
-                    if key not in mapped_columns and value:
-                        metadata[key] = value
-
-                # Get optional name
-                name = row.get(col_name, '').strip() if col_name else ''
-
-                # Create or update asset
-                asset, created = Asset.objects.update_or_create(
-                    project=project,
-                    asset_id=asset_id,
-                    defaults={
-                        'asset_type': asset_type,
-                        'name': name,
-                        'original_x': x,
-                        'original_y': y,
-                        'metadata': metadata,
-                        'import_batch': batch,
-                    }
-                )
+                    if len(asset_type_name) > ASSET_TYPE_NAME_MAX_LENGTH:
+                        if len(errors) < MAX_ERRORS:
+                            errors.append(
+                                f"Row {row_num}: asset_type longer than {ASSET_TYPE_NAME_MAX_LENGTH} characters"
+                            )
+                        else:
+                            error_overflow += 1
+                        continue
+                    asset_type = types_by_value[raw_type] = asset_types_cache[asset_type_name.lower()]
 
-                if created:
-                    results['created'] += 1
-                else:
-                    results['updated'] += 1
+            # Build metadata from extra columns
+            metadata = {column: value for column, i in extra_columns if (value := row[i])}
 
-                results['assets'].append({
-                    'asset_id': asset_id,
-                    'created': created,
-                    'x': x,
-                    'y': y
-                })
+        except Exception as e:
+            if len(errors) < MAX_ERRORS:
+                errors.append(f"Row {row_num}: {str(e)}")
+            else:
+                error_overflow += 1
+            continue
 
-            except Exception as e:
-                results['errors'].append(f"Row {row_num}: {str(e)}")
+        # A repeated asset_id must update the row queued earlier, so flush first
+        if asset_id in pending_ids:
+            _upsert_assets(batch, pending, existing_pks, results)
+            pending_ids.clear()
+
+        pending.append(Asset(
+            project=project,
+            asset_id=asset_id,
+            asset_type=asset_type,
+            name=name,
+            original_x=x,
+            original_y=y,
+            metadata=metadata,
+            import_batch=batch,
+        ))
+        pending_ids.add(asset_id)
+        if len(pending) >= BATCH_SIZE:
+            _upsert_assets(batch, pending, existing_pks, results)
+            pending_ids.clear()
 
-        # Update batch asset count
-        batch.asset_count = results['created'] + results['updated']
-        batch.save(update_fields=['asset_count'])
+    _upsert_assets(batch, pending, existing_pks, results)
+    results['errors_truncated'] = error_overflow
 
     logger.info("CSV import for project %d: %d created, %d updated, %d errors",
-                project.pk, results['created'], results['updated'], len(results['errors']))
-    if results['errors']:
-        logger.warning("CSV import errors: %s", results['errors'][:5])  # Log first 5
+                project.pk, results['created'], results['updated'], len(errors) + error_overflow)
+    if errors and logger.isEnabledFor(logging.WARNING):
+        logger.warning("CSV import errors: %r", errors[:5])  # Log first 5
 
     return results
@@ -1,23 +1,44 @@
 """Export service for generating PDFs with overlays and reports."""
 import os
+import io
 import csv
 import logging
-from io import StringIO
-from django.http import HttpResponse
+from itertools import islice
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
 from django.conf import settings
 from django.utils.text import slugify
+from ..models import AdjustmentLog
 from .pdf_processor import render_overlay_on_pdf
 
 logger = logging.getLogger(__name__)
 
+# Assets read per query and CSV rows encoded per streamed chunk
+REPORT_CHUNK_SIZE = 500
+
+# Leading characters a spreadsheet may treat as the start of a formula
+_DANGEROUS_PREFIXES = frozenset('=+-@\t\r')
+
 
 def sanitize_csv_value(value):
     """Sanitize a string value for CSV export to prevent formula injection."""
-    if isinstance(value, str) and value and value[0] in ('=', '+', '-', '@', '\t', '\r'):
+    if isinstance(value, str) and value and value[0] in _DANGEROUS_PREFIXES:
         return "'" + value
     return value
 
 
+def _csv_chunks(rows, chunk_size=REPORT_CHUNK_SIZE):
+    """Encode rows as CSV text, yielding one string per chunk of rows."""
+    rows = iter(rows)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    while chunk := list(islice(rows, chunk_size)):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
 def sanitize_filename(name, max_length=100):
     """
     Sanitize a string for use as a filename.
@@ -38,7 +59,8 @@ def export_sheet_with_overlays(sheet, assets):
 
     Args:
         sheet: Sheet model instance
-        assets: QuerySet of assets to overlay
+        assets: Assets to overlay (QuerySet or list; include asset_type via
+            select_related when exporting several sheets)
 
     Returns:
         Path to the exported PDF
@@ -94,44 +116,13 @@ def generate_adjustment_report(project, adjusted_assets, logs, format_type='csv'
         format_type: 'csv' or 'json'
 
     Returns:
-        HttpResponse with CSV data
+        StreamingHttpResponse with CSV data
     """
     if format_type == 'csv':
-        output = StringIO()
-        writer = csv.writer(output)
-
-        # Header
-        writer.writerow([
-            'Asset ID', 'Asset Name', 'Asset Type',
-            'Original X (m)', 'Original Y (m)',
-            'Adjusted X (m)', 'Adjusted Y (m)',
-            'Delta X (m)', 'Delta Y (m)', 'Delta Distance (m)',
-            'Adjustment Count', 'Last Adjustment Notes'
-        ])
-
-        # Data rows
-        for asset in adjusted_assets:
-            delta_x = asset.adjusted_x - asset.original_x if asset.adjusted_x else 0
-            delta_y = asset.adjusted_y - asset.original_y if asset.adjusted_y else 0
-            last_log = asset.adjustment_logs.first()
-            last_notes = last_log.notes if last_log else ''
-
-            writer.writerow([
-                sanitize_csv_value(asset.asset_id),
-                sanitize_csv_value(asset.name),
-                sanitize_csv_value(asset.asset_type.name),
-                f"{asset.original_x:.3f}",
-                f"{asset.original_y:.3f}",
-                f"{asset.adjusted_x:.3f}" if asset.adjusted_x else '',
-                f"{asset.adjusted_y:.3f}" if asset.adjusted_y else '',
-                f"{delta_x:.3f}",
-                f"{delta_y:.3f}",
-                f"{asset.delta_distance:.3f}",
-                asset.adjustment_logs.count(),
-                sanitize_csv_value(last_notes)
-            ])
-
-        response = HttpResponse(output.getvalue(), content_type='text/csv')
+        # Rows are written as the response is consumed, so memory stays flat
+        # and the download starts before the last asset has been read
+        chunks = _csv_chunks(_adjustment_report_rows(adjusted_assets))
+        response = StreamingHttpResponse(chunks, content_type='text/csv')
         # Security: Sanitize filename to prevent header injection
         safe_name = sanitize_filename(project.name)
         response['Content-Disposition'] = f'attachment; filename="{safe_name}_adjustments.csv"'
@@ -140,6 +131,47 @@ def generate_adjustment_report(project, adjusted_assets, logs, format_type='csv'
     return None
 
 
+def _adjustment_report_rows(adjusted_assets):
+    """Yield the header and one row per adjusted asset for the CSV report."""
+    yield [
+        'Asset ID', 'Asset Name', 'Asset Type',
+        'Original X (m)', 'Original Y (m)',
+        'Adjusted X (m)', 'Adjusted Y (m)',
+        'Delta X (m)', 'Delta Y (m)', 'Delta Distance (m)',
+        'Adjustment Count', 'Last Adjustment Notes'
+    ]
+
+    # Types and logs arrive with each chunk of assets instead of a query per asset,
+    # and only the columns written below are selected
+    assets = adjusted_assets.select_related('asset_type').only(
+        'project', 'asset_id', 'name', 'original_x', 'original_y', 'adjusted_x', 'adjusted_y', 'is_adjusted',
+        'asset_type__name',
+    ).prefetch_related(
+        Prefetch('adjustment_logs', queryset=AdjustmentLog.objects.only('asset', 'notes', 'timestamp'),
+                 to_attr='prefetched_logs'),
+    )
+    for asset in assets.iterator(chunk_size=REPORT_CHUNK_SIZE):
+        delta_x = asset.adjusted_x - asset.original_x if asset.adjusted_x else 0
+        delta_y = asset.adjusted_y - asset.original_y if asset.adjusted_y else 0
+        asset_logs = asset.prefetched_logs  # Plain list, newest first
+        last_notes = asset_logs[0].notes if asset_logs else ''
+
+        yield [
+            sanitize_csv_value(asset.asset_id),
+            sanitize_csv_value(asset.name),
+            sanitize_csv_value(asset.asset_type.name),
+            f"{asset.original_x:.3f}",
+            f"{asset.original_y:.3f}",
+            f"{asset.adjusted_x:.3f}" if asset.adjusted_x else '',
+            f"{asset.adjusted_y:.3f}" if asset.adjusted_y else '',
+            f"{delta_x:.3f}",
+            f"{delta_y:.3f}",
+            f"{asset.delta_distance:.3f}",
+            len(asset_logs),
+            sanitize_csv_value(last_notes)
+        ]
+
+
 def generate_full_project_export(project):
     """
     Generate a complete export package for a project.
@@ -155,7 +187,7 @@ def generate_full_project_export(project):
     export_dir = os.path.join(settings.MEDIA_ROOT, 'exports', f'project_{project.id}_full')
     os.makedirs(export_dir, exist_ok=True)
 
-    assets = project.assets.all()
+    assets = list(project.assets.select_related('asset_type'))
     exported_sheets = []
 
     # Export each sheet
@@ -176,7 +208,7 @@ def generate_full_project_export(project):
         # Security: Sanitize filename
         safe_project_name = sanitize_filename(project.name)
         report_path = os.path.join(export_dir, f"{safe_project_name}_adjustments.csv")
-        with open(report_path, 'w') as f:
-            f.write(report_response.content.decode('utf-8'))
+        with open(report_path, 'wb') as f:
+            f.writelines(report_response.streaming_content)
 
     return export_dir
@@ -1,67 +1,145 @@
 """PDF processing service for rendering and manipulating PDFs."""
 import os
+import hashlib
+import string
 import logging
+import tempfile
+from contextlib import suppress
+from functools import lru_cache
+from io import BytesIO
 import fitz  # PyMuPDF
 from PIL import Image
-from io import BytesIO
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
 
+# Storage directory for rendered pages, keyed by PDF content, page and DPI.
+# Entries are read and written as local files, like the sheets' PDFs
+RENDER_CACHE_DIR = 'rendered_cache'
+
+# Suffix of cache entries still being written
+CACHE_TMP_SUFFIX = '.tmp'
+
+
+def render_cache_name(pdf_path, page_number, dpi):
+    """Storage name of the cached PNG for one page of a PDF at the given DPI."""
+    stat = os.stat(pdf_path)
+    digest = _file_digest(pdf_path, stat.st_size, stat.st_mtime_ns)
+    return f"{RENDER_CACHE_DIR}/{digest}_p{page_number}_{dpi}.png"
+
+
+@lru_cache(maxsize=64)  # Every page of a multi-page upload shares one PDF file
+def _file_digest(path, size, mtime_ns):
+    """
+    Hash a file's content. size and mtime_ns are only part of the cache key,
+    so a file rewritten in place is hashed again.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        # Chunked by hand: hashlib.file_digest needs Python 3.11
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _read_cache_entry(cache_name):
+    """Return the cached PNG bytes, or None if there is no entry (or it was just pruned)."""
+    try:
+        with open(default_storage.path(cache_name), 'rb') as cached:
+            return cached.read()
+    except FileNotFoundError:
+        return None
+
+
+def _write_cache_entry(cache_name, png_bytes):
+    """
+    Write a render under its exact cache name.
+
+    The bytes go to a temporary file that is then renamed over the entry, so
+    readers never see a partial PNG and a concurrent render of the same page
+    replaces the entry rather than leaving a renamed copy behind. The cache
+    only saves work, so a failed write is logged and otherwise ignored.
+    """
+    path = default_storage.path(cache_name)
+    directory = os.path.dirname(path)
+    tmp_path = None
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, suffix=CACHE_TMP_SUFFIX, delete=False) as tmp:
+            tmp_path = tmp.name
+            tmp.write(png_bytes)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        if tmp_path:
+            with suppress(OSError):
+                os.unlink(tmp_path)
+        logger.warning("Could not write render cache entry %s: %s", cache_name, e)
+
+
 def render_pdf_page(sheet, dpi=150):
     """
     Render a PDF page to an image and save it to the sheet.
 
+    A page that was already rendered from identical PDF content at the same
+    DPI is copied from the render cache instead of being rasterized again.
+
     Args:
         sheet: Sheet model instance
         dpi: Resolution for rendering (default 150)
     """
     pdf_path = sheet.pdf_file.path
-    page_number = sheet.page_number - 1  # PyMuPDF uses 0-based indexing
-
-    # Open the PDF
-    doc = fitz.open(pdf_path)
-
-    if page_number >= len(doc):
-        doc.close()
-        raise ValueError(f"Page {sheet.page_number} does not exist in PDF (has {len(doc)} pages)")
-
-    page = doc[page_number]
-
-    # Render at specified DPI
-    zoom = dpi / 72  # 72 is the default PDF resolution
-    matrix = fitz.Matrix(zoom, zoom)
-    pix = page.get_pixmap(matrix=matrix)
-
-    # Convert to PIL Image
-    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-    # Save to BytesIO
-    buffer = BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
+    cache_name = render_cache_name(pdf_path, sheet.page_number, dpi)
+
+    png_bytes = _read_cache_entry(cache_name)
+    if png_bytes is not None:
+        with Image.open(BytesIO(png_bytes)) as img:
+            width, height = img.size
+        logger.info("Using cached render for sheet %d page %d at %d DPI",
+                    sheet.id, sheet.page_number, dpi)
+    else:
+        png_bytes, width, height = _rasterize_page(pdf_path, sheet.page_number, dpi)
+        _write_cache_entry(cache_name, png_bytes)
+        logger.info("Rendered sheet %d page %d at %d DPI (%dx%d px)",
+                    sheet.id, sheet.page_number, dpi, width, height)
 
     # Save to sheet
     filename = f"sheet_{sheet.id}_page_{sheet.page_number}.png"
-    sheet.rendered_image.save(filename, ContentFile(buffer.read()), save=False)
-    sheet.image_width = pix.width
-    sheet.image_height = pix.height
+    sheet.rendered_image.save(filename, ContentFile(png_bytes), save=False)
+    sheet.image_width = width
+    sheet.image_height = height
     sheet.save()
 
-    doc.close()
-
-    logger.info("Rendered sheet %d page %d at %d DPI (%dx%d px)",
-                sheet.id, sheet.page_number, dpi, pix.width, pix.height)
-
     return {
-        'width': pix.width,
-        'height': pix.height,
+        'width': width,
+        'height': height,
         'path': sheet.rendered_image.path
     }
 
 
+def _rasterize_page(pdf_path, page_number, dpi):
+    """Rasterize one page (1-based) of a PDF and return (png_bytes, width, height)."""
+    # Open the PDF
+    doc = fitz.open(pdf_path)
+    try:
+        if page_number > len(doc):
+            raise ValueError(f"Page {page_number} does not exist in PDF (has {len(doc)} pages)")
+
+        page = doc[page_number - 1]  # PyMuPDF uses 0-based indexing
+
+        # Render at specified DPI
+        zoom = dpi / 72  # 72 is the default PDF resolution
+        matrix = fitz.Matrix(zoom, zoom)
+        pix = page.get_pixmap(matrix=matrix)
+
+        # Encode the PNG directly from the pixmap instead of copying it through PIL
+        return pix.tobytes('png'), pix.width, pix.height
+    finally:
+        doc.close()
+
+
 def get_pdf_page_count(pdf_path):
     """Get the number of pages in a PDF."""
     doc = fitz.open(pdf_path)
@@ -200,12 +278,18 @@ def draw_star(page, cx, cy, radius, color):
     page.draw_polyline(points, color=color, fill=color, closePath=True)
 
 
+@lru_cache(maxsize=256)  # Overlays reuse a small palette of asset type colors
 def parse_color(hex_color):
     """Convert hex color to RGB tuple (0-1 range). Returns red on invalid input."""
     try:
         hex_color = str(hex_color).lstrip('#')
         if len(hex_color) < 6:
             return (1.0, 0.0, 0.0)
-        return tuple(int(hex_color[i:i+2], 16) / 255 for i in (0, 2, 4))
+        digits = hex_color[:6]
+        # int() would also accept a sign, underscores and whitespace
+        if not all(c in string.hexdigits for c in digits):
+            return (1.0, 0.0, 0.0)
+        rgb = int(digits, 16)
+        return ((rgb >> 16) / 255, ((rgb >> 8) & 0xFF) / 255, (rgb & 0xFF) / 255)
     except (ValueError, TypeError):
         return (1.0, 0.0, 0.0)
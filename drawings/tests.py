@@ -1,48 +1,80 @@
-"""Tests for the drawings app."""
+"""Tests for the drawings app.
+
+Database tests use TestCase, which rolls each test back to a savepoint, and
+tests that never query use SimpleTestCase. Nothing here needs committed
+state, so there is no TransactionTestCase: its table flush after every test
+would be far slower.
+"""
 import csv
 import io
-import math
+import json
+import os
+import shutil
+import tempfile
+from unittest import skipUnless
 from unittest.mock import patch, MagicMock
 
+import fitz
+
+from django.conf import settings
+from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase, override_settings
-from rest_framework.test import APIClient
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
 
 from .models import (
     Project, Sheet, AssetType, ImportBatch, Asset, AdjustmentLog, ColumnPreset,
 )
-from .validators import PDFFileValidator, ImageFileValidator
+from .validators import PDFFileValidator, ImageFileValidator, read_header
+from .services import csv_importer
 from .services.csv_importer import import_assets_from_csv
 
 
+# Default fixture bodies, built once and shared by every upload helper call
+_PDF_BYTES = b'%PDF-1.4 minimal test content'
+_PNG_BYTES = b'\x89PNG\r\n\x1a\n' + bytes(50)  # Minimal PNG header
+
+
 def make_pdf_file(name='test.pdf', size=None):
     """Create a minimal valid PDF file for testing."""
-    content = b'%PDF-1.4 minimal test content'
+    content = _PDF_BYTES
     if size and size > len(content):
-        content += b'\x00' * (size - len(content))
+        content += bytes(size - len(content))
     return SimpleUploadedFile(name, content, content_type='application/pdf')
 
 
 def make_png_file(name='test.png', size=None):
     """Create a minimal valid PNG file for testing."""
-    # Minimal PNG header
-    content = b'\x89PNG\r\n\x1a\n' + b'\x00' * 50
+    content = _PNG_BYTES
     if size and size > len(content):
-        content += b'\x00' * (size - len(content))
+        content += bytes(size - len(content))
     return SimpleUploadedFile(name, content, content_type='image/png')
 
 
+def _is_plain_csv_value(value):
+    """True if the value can be written to CSV without quoting."""
+    return isinstance(value, (str, int, float)) and not any(c in str(value) for c in ',"\r\n')
+
+
 def make_csv_content(rows, fieldnames=None):
     """Build an in-memory CSV file from rows."""
     if fieldnames is None:
-        fieldnames = rows[0].keys() if rows else []
+        fieldnames = list(rows[0].keys()) if rows else []
+    if (all(map(_is_plain_csv_value, fieldnames))
+            and all(_is_plain_csv_value(row.get(k, '')) for row in rows for k in fieldnames)):
+        # Nothing needs quoting, so join the fields directly
+        lines = [','.join(fieldnames)]
+        lines.extend(','.join(str(row.get(k, '')) for k in fieldnames) for row in rows)
+        content = '\n'.join(lines) + '\n'
+        return SimpleUploadedFile('test.csv', content.encode('utf-8'), content_type='text/csv')
     buf = io.StringIO()
-    writer = csv.DictWriter(buf, fieldnames=fieldnames)
-    writer.writeheader()
-    for row in rows:
-        writer.writerow(row)
-    buf.seek(0)
+    writer = csv.writer(buf)
+    writer.writerow(fieldnames)
+    writer.writerows([row.get(k, '') for k in fieldnames] for row in rows)
     return SimpleUploadedFile('test.csv', buf.getvalue().encode('utf-8'), content_type='text/csv')
 
 
@@ -77,8 +109,9 @@ class ProjectModelTests(TestCase):
 
 
 class SheetModelTests(TestCase):
-    def setUp(self):
-        self.project = create_project()
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = create_project()
 
     def test_create(self):
         s = Sheet.objects.create(
@@ -124,8 +157,9 @@ class AssetTypeModelTests(TestCase):
 
     def test_unique_name(self):
         create_asset_type(name='Valve')
-        with self.assertRaises(Exception):
-            create_asset_type(name='Valve')
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                create_asset_type(name='Valve')
 
 
 class ImportBatchModelTests(TestCase):
@@ -136,9 +170,10 @@ class ImportBatchModelTests(TestCase):
 
 
 class AssetModelTests(TestCase):
-    def setUp(self):
-        self.project = create_project()
-        self.asset_type = create_asset_type()
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = create_project()
+        cls.asset_type = create_asset_type()
 
     def test_current_coords_unadjusted(self):
         a = Asset.objects.create(
@@ -157,7 +192,7 @@ class AssetModelTests(TestCase):
         )
         self.assertEqual(a.current_x, 13.0)
         self.assertEqual(a.current_y, 24.0)
-        self.assertAlmostEqual(a.delta_distance, 5.0)
+        self.assertEqual(a.delta_distance, 5.0)
 
     def test_str(self):
         a = Asset.objects.create(
@@ -171,11 +206,12 @@ class AssetModelTests(TestCase):
             project=self.project, asset_type=self.asset_type,
             asset_id='DUP', original_x=0, original_y=0,
         )
-        with self.assertRaises(Exception):
-            Asset.objects.create(
-                project=self.project, asset_type=self.asset_type,
-                asset_id='DUP', original_x=1, original_y=1,
-            )
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Asset.objects.create(
+                    project=self.project, asset_type=self.asset_type,
+                    asset_id='DUP', original_x=1, original_y=1,
+                )
 
 
 class AdjustmentLogModelTests(TestCase):
@@ -189,9 +225,9 @@ class AdjustmentLogModelTests(TestCase):
         log = AdjustmentLog.objects.create(
             asset=a, from_x=0, from_y=0, to_x=3.0, to_y=4.0,
         )
-        self.assertAlmostEqual(log.delta_x, 3.0)
-        self.assertAlmostEqual(log.delta_y, 4.0)
-        self.assertAlmostEqual(log.delta_distance, 5.0)
+        self.assertEqual(log.delta_x, 3.0)
+        self.assertEqual(log.delta_y, 4.0)
+        self.assertEqual(log.delta_distance, 5.0)
 
 
 class ColumnPresetModelTests(TestCase):
@@ -201,15 +237,16 @@ class ColumnPresetModelTests(TestCase):
 
     def test_unique_together(self):
         ColumnPreset.objects.create(role='x', column_name='Easting_unique')
-        with self.assertRaises(Exception):
-            ColumnPreset.objects.create(role='x', column_name='Easting_unique')
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                ColumnPreset.objects.create(role='x', column_name='Easting_unique')
 
 
 # ---------------------------------------------------------------------------
 # Validator tests
 # ---------------------------------------------------------------------------
 
-class PDFFileValidatorTests(TestCase):
+class PDFFileValidatorTests(SimpleTestCase):
     def test_valid_pdf(self):
         v = PDFFileValidator()
         f = make_pdf_file()
@@ -233,8 +270,24 @@ class PDFFileValidatorTests(TestCase):
         with self.assertRaises(ValidationError):
             v(f)
 
+    def test_header_read_once_per_upload(self):
+        v = PDFFileValidator()
+        f = make_pdf_file()
+        v(f)
+        with patch.object(f, 'file', MagicMock()) as stream:
+            v(f)
+        stream.read.assert_not_called()
+
+    def test_header_peeked_from_upload_spooled_to_disk(self):
+        upload = TemporaryUploadedFile('big.pdf', 'application/pdf', 0, None)
+        upload.write(_PDF_BYTES)
+        upload.seek(0)
+        with upload, patch.object(upload.file, 'seek', side_effect=AssertionError('seeked')):
+            self.assertEqual(read_header(upload, len(b'%PDF-')), b'%PDF-')
+            self.assertEqual(upload.tell(), 0)
 
-class ImageFileValidatorTests(TestCase):
+
+class ImageFileValidatorTests(SimpleTestCase):
     def test_valid_png(self):
         v = ImageFileValidator()
         f = make_png_file()
@@ -245,6 +298,11 @@ class ImageFileValidatorTests(TestCase):
         f = SimpleUploadedFile('img.jpg', b'\xff\xd8\xff\xe0' + b'\x00' * 50, content_type='image/jpeg')
         v(f)  # should not raise
 
+    def test_valid_webp(self):
+        v = ImageFileValidator()
+        f = SimpleUploadedFile('img.webp', b'RIFF\x24\x00\x00\x00WEBPVP8 ' + b'\x00' * 40, content_type='image/webp')
+        v(f)  # should not raise
+
     def test_rejects_oversized(self):
         v = ImageFileValidator(max_size=100)
         f = make_png_file(size=200)
@@ -253,7 +311,7 @@ class ImageFileValidatorTests(TestCase):
 
     def test_rejects_bad_extension(self):
         v = ImageFileValidator()
-        f = SimpleUploadedFile('img.bmp', b'\x89PNG\r\n\x1a\n' + b'\x00' * 50, content_type='image/bmp')
+        f = SimpleUploadedFile('img.bmp', _PNG_BYTES, content_type='image/bmp')
         with self.assertRaises(ValidationError):
             v(f)
 
@@ -263,40 +321,75 @@ class ImageFileValidatorTests(TestCase):
         with self.assertRaises(ValidationError):
             v(f)
 
+    def test_known_signature_skips_libmagic(self):
+        detector = MagicMock()
+        detector.from_buffer.return_value = 'image/webp'
+        with patch('drawings.validators.HAS_MAGIC', True), \
+                patch('drawings.validators._MAGIC', detector, create=True):
+            ImageFileValidator()(make_png_file())
+            ImageFileValidator()(SimpleUploadedFile('img.webp', b'RIFF\x24\x00\x00\x00WEBPVP8 '))
+        self.assertEqual(detector.from_buffer.call_count, 1)  # Only the WebP
+
 
 # ---------------------------------------------------------------------------
 # CSV importer service tests
 # ---------------------------------------------------------------------------
 
 class CsvImporterTests(TestCase):
-    def setUp(self):
-        self.project = create_project()
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = create_project()
+
+    def _import(self, rows, fieldnames=None, **kwargs):
+        # Not wrapped in transaction.atomic(): the importer already commits each
+        # batch in its own atomic block, and inside a TestCase that block is a
+        # savepoint, so an extra outer block would only add another savepoint
+        return import_assets_from_csv(self.project, make_csv_content(rows, fieldnames), **kwargs)
 
     def test_basic_import(self):
-        csv_file = make_csv_content([
+        result = self._import([
             {'asset_id': 'A1', 'asset_type': 'Valve', 'x': '100.5', 'y': '200.3', 'name': 'First'},
             {'asset_id': 'A2', 'asset_type': 'Valve', 'x': '101.0', 'y': '201.0', 'name': 'Second'},
         ])
-        result = import_assets_from_csv(self.project, csv_file)
         self.assertEqual(result['created'], 2)
         self.assertEqual(result['updated'], 0)
         self.assertEqual(len(result['errors']), 0)
         self.assertEqual(Asset.objects.filter(project=self.project).count(), 2)
 
     def test_creates_import_batch(self):
-        csv_file = make_csv_content([
+        self._import([
             {'asset_id': 'B1', 'asset_type': 'Pipe', 'x': '0', 'y': '0', 'name': ''},
-        ])
-        result = import_assets_from_csv(self.project, csv_file, filename='myfile.csv')
+        ], filename='myfile.csv')
         batch = ImportBatch.objects.get(project=self.project)
         self.assertEqual(batch.filename, 'myfile.csv')
         self.assertEqual(batch.asset_count, 1)
 
+    @patch('drawings.services.csv_importer.BATCH_SIZE', 2)
+    def test_import_spanning_several_batches(self):
+        result = self._import([
+            {'asset_id': f'S{i}', 'asset_type': 'Pipe', 'x': str(i), 'y': '0', 'name': ''}
+            for i in range(5)
+        ])
+        self.assertEqual(result['created'], 5)
+        self.assertEqual(Asset.objects.filter(project=self.project).count(), 5)
+        self.assertEqual(ImportBatch.objects.get(project=self.project).asset_count, 5)
+
+    def test_import_queries_do_not_grow_with_rows(self):
+        def rows(prefix, n):
+            return [
+                {'asset_id': f'{prefix}{i}', 'asset_type': 'Pipe', 'x': str(i), 'y': '0', 'name': ''}
+                for i in range(n)
+            ]
+
+        self._import(rows('W', 1))  # creates the asset type
+        with CaptureQueriesContext(connection) as small:
+            self._import(rows('Q', 3))
+        with CaptureQueriesContext(connection) as large:
+            result = self._import(rows('R', 30))
+        self.assertEqual(result['created'], 30)
+        self.assertEqual(len(large), len(small))
+
     def test_custom_column_mapping(self):
-        csv_file = make_csv_content(
-            [{'TN': 'X1', 'Type': 'Hydrant', 'Easting': '50', 'Northing': '60', 'Label': 'H1'}],
-            fieldnames=['TN', 'Type', 'Easting', 'Northing', 'Label'],
-        )
         mapping = {
             'asset_id': 'TN',
             'asset_type': 'Type',
@@ -304,99 +397,286 @@ class CsvImporterTests(TestCase):
             'y': 'Northing',
             'name': 'Label',
         }
-        result = import_assets_from_csv(self.project, csv_file, column_mapping=mapping)
+        result = self._import(
+            [{'TN': 'X1', 'Type': 'Hydrant', 'Easting': '50', 'Northing': '60', 'Label': 'H1'}],
+            fieldnames=['TN', 'Type', 'Easting', 'Northing', 'Label'],
+            column_mapping=mapping,
+        )
         self.assertEqual(result['created'], 1)
         a = Asset.objects.get(project=self.project, asset_id='X1')
-        self.assertAlmostEqual(a.original_x, 50.0)
-        self.assertAlmostEqual(a.original_y, 60.0)
+        self.assertEqual(a.original_x, 50.0)
+        self.assertEqual(a.original_y, 60.0)
         self.assertEqual(a.name, 'H1')
 
-    def test_missing_columns_raises(self):
-        csv_file = make_csv_content(
-            [{'only_col': 'val'}],
-            fieldnames=['only_col'],
+    def test_utf8_bom_header(self):
+        csv_file = SimpleUploadedFile(
+            'bom.csv',
+            '\ufeffasset_id,asset_type,x,y,name\nBOM1,Valve,1,2,Ünïcode\n'.encode('utf-8'),
+            content_type='text/csv',
         )
+        result = import_assets_from_csv(self.project, csv_file)
+        self.assertEqual(result['created'], 1)
+        self.assertEqual(Asset.objects.get(asset_id='BOM1').name, 'Ünïcode')
+
+    def test_import_from_upload_spooled_to_disk(self):
+        upload = TemporaryUploadedFile('big.csv', 'text/csv', 0, 'utf-8')
+        upload.write('\ufeffasset_id,asset_type,x,y,name\nT1,Valve,1,2,Disk\n'.encode('utf-8'))
+        upload.seek(0)
+        with upload:
+            result = import_assets_from_csv(self.project, upload)
+        self.assertEqual(result['created'], 1)
+        self.assertEqual(Asset.objects.get(asset_id='T1').name, 'Disk')
+
+    @patch('drawings.services.csv_importer.MAX_ERRORS', 2)
+    def test_errors_capped(self):
+        result = self._import([
+            {'asset_id': f'E{i}', 'asset_type': 'Valve', 'x': 'bad', 'y': '0', 'name': ''}
+            for i in range(5)
+        ])
+        self.assertEqual(len(result['errors']), 2)
+        self.assertEqual(result['errors_truncated'], 3)
+
+    def test_short_row_logged_as_error(self):
+        csv_file = SimpleUploadedFile(
+            'short.csv',
+            b'asset_id,asset_type,x,y,name\nS1,Valve\n\nS2,Valve,1,2\n',
+            content_type='text/csv',
+        )
+        result = import_assets_from_csv(self.project, csv_file)
+        self.assertEqual(result['created'], 1)
+        self.assertEqual(len(result['errors']), 1)
+        self.assertIn('Invalid coordinates', result['errors'][0])
+
+    def test_missing_columns_raises(self):
         with self.assertRaises(ValueError):
-            import_assets_from_csv(self.project, csv_file)
+            self._import([{'only_col': 'val'}], fieldnames=['only_col'])
 
     def test_invalid_coords_logged_as_error(self):
-        csv_file = make_csv_content([
+        result = self._import([
             {'asset_id': 'OK', 'asset_type': 'T', 'x': '10', 'y': '20', 'name': ''},
             {'asset_id': 'BAD', 'asset_type': 'T', 'x': 'abc', 'y': 'def', 'name': ''},
         ])
-        result = import_assets_from_csv(self.project, csv_file)
         self.assertEqual(result['created'], 1)
         self.assertEqual(len(result['errors']), 1)
-        self.assertTrue(Asset.objects.filter(asset_id='OK').exists())
-        self.assertFalse(Asset.objects.filter(asset_id='BAD').exists())
+        asset_ids = set(Asset.objects.filter(project=self.project).values_list('asset_id', flat=True))
+        self.assertEqual(asset_ids, {'OK'})
+
+    @patch('drawings.services.csv_importer.BATCH_SIZE', 2)
+    def test_undecodable_row_fails_before_anything_is_stored(self):
+        # Larger than the 8KB the text wrapper decodes at a time, so the bad
+        # bytes are only reached after the first batches could have been written
+        good = ''.join(f'D{i},Valve,{i},0,\n' for i in range(1000)).encode('utf-8')
+        content = b'asset_id,asset_type,x,y,name\n' + good + b'BAD,Valve,1,2,\xff\xfe\n'
+        for fixed_type in (None, 'Valve'):
+            csv_file = SimpleUploadedFile('bad.csv', content, content_type='text/csv')
+            with self.subTest(fixed_asset_type=fixed_type), self.assertRaises(UnicodeDecodeError):
+                import_assets_from_csv(self.project, csv_file, fixed_asset_type=fixed_type)
+        self.assertFalse(Asset.objects.filter(project=self.project).exists())
+        self.assertFalse(ImportBatch.objects.filter(project=self.project).exists())
+
+    def test_non_finite_coordinates_logged_as_error(self):
+        csv_file = SimpleUploadedFile(
+            'nan.csv', b'asset_id,asset_type,x,y\nOK1,T,1,1\nN,T,nan,1\nI,T,1,-inf\nOK2,T,2,2\n',
+            content_type='text/csv',
+        )
+        result = import_assets_from_csv(self.project, csv_file)
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(len(result['errors']), 2)
+        self.assertTrue(all('Invalid coordinates' in e for e in result['errors']))
+        asset_ids = set(Asset.objects.filter(project=self.project).values_list('asset_id', flat=True))
+        self.assertEqual(asset_ids, {'OK1', 'OK2'})
+
+    def test_overlong_values_logged_as_error(self):
+        result = self._import([
+            {'asset_id': 'L' * 101, 'asset_type': 'Valve', 'x': '1', 'y': '1', 'name': ''},
+            {'asset_id': 'L2', 'asset_type': 'Valve', 'x': '1', 'y': '1', 'name': 'n' * 256},
+            {'asset_id': 'L3', 'asset_type': 'T' * 101, 'x': '1', 'y': '1', 'name': ''},
+            {'asset_id': 'L4', 'asset_type': 'Valve', 'x': '1', 'y': '1', 'name': 'n' * 255},
+        ])
+        self.assertEqual(result['created'], 1)
+        self.assertEqual(len(result['errors']), 3)
+        self.assertIn('asset_id longer than 100', result['errors'][0])
+        self.assertIn('name longer than 255', result['errors'][1])
+        self.assertIn('asset_type longer than 100', result['errors'][2])
+        self.assertFalse(AssetType.objects.filter(name='T' * 101).exists())
+
+    def test_rejected_rows_do_not_create_asset_types(self):
+        result = self._import([
+            {'asset_id': 'A1', 'asset_type': 'Ghost', 'x': 'abc', 'y': 'def', 'name': ''},
+            {'asset_id': '', 'asset_type': 'Phantom', 'x': '1', 'y': '2', 'name': ''},
+        ])
+        self.assertEqual(len(result['errors']), 2)
+        self.assertFalse(AssetType.objects.filter(name__in=['Ghost', 'Phantom']).exists())
 
     def test_reimport_updates_existing(self):
-        csv_file1 = make_csv_content([
+        self._import([
             {'asset_id': 'U1', 'asset_type': 'Gate', 'x': '1', 'y': '2', 'name': 'v1'},
         ])
-        import_assets_from_csv(self.project, csv_file1)
-        csv_file2 = make_csv_content([
+        result = self._import([
             {'asset_id': 'U1', 'asset_type': 'Gate', 'x': '10', 'y': '20', 'name': 'v2'},
         ])
-        result = import_assets_from_csv(self.project, csv_file2)
         self.assertEqual(result['updated'], 1)
         a = Asset.objects.get(project=self.project, asset_id='U1')
-        self.assertAlmostEqual(a.original_x, 10.0)
+        self.assertEqual(a.original_x, 10.0)
         self.assertEqual(a.name, 'v2')
 
+    def test_duplicate_asset_id_in_file_updates(self):
+        result = self._import([
+            {'asset_id': 'D1', 'asset_type': 'Gate', 'x': '1', 'y': '2', 'name': 'first'},
+            {'asset_id': 'D1', 'asset_type': 'Gate', 'x': '3', 'y': '4', 'name': 'second'},
+        ])
+        self.assertEqual(result['created'], 1)
+        self.assertEqual(result['updated'], 1)
+        a = Asset.objects.get(project=self.project, asset_id='D1')
+        self.assertEqual(a.name, 'second')
+
+    def test_reimport_without_upsert_support(self):
+        """Backends that cannot upsert on (project, asset_id) fall back to bulk_create + bulk_update."""
+        self._import([
+            {'asset_id': 'N1', 'asset_type': 'Gate', 'x': '1', 'y': '2', 'name': 'v1'},
+        ])
+        with patch.object(connection.features, 'supports_update_conflicts_with_target', False):
+            result = self._import([
+                {'asset_id': 'N1', 'asset_type': 'Gate', 'x': '10', 'y': '20', 'name': 'v2'},
+                {'asset_id': 'N2', 'asset_type': 'Gate', 'x': '3', 'y': '4', 'name': 'new'},
+                {'asset_id': 'N2', 'asset_type': 'Gate', 'x': '5', 'y': '6', 'name': 'again'},
+            ])
+        self.assertEqual(result['created'], 1)
+        self.assertEqual(result['updated'], 2)
+        self.assertEqual(Asset.objects.get(project=self.project, asset_id='N1').name, 'v2')
+        self.assertEqual(Asset.objects.get(project=self.project, asset_id='N2').name, 'again')
+
+    def test_new_asset_types_matched_case_insensitively(self):
+        result = self._import([
+            {'asset_id': 'T1', 'asset_type': 'Hydrant', 'x': '1', 'y': '2', 'name': ''},
+            {'asset_id': 'T2', 'asset_type': 'HYDRANT', 'x': '3', 'y': '4', 'name': ''},
+        ])
+        self.assertEqual(result['created'], 2)
+        hydrant = AssetType.objects.get(name__iexact='hydrant')
+        self.assertEqual(hydrant.name, 'Hydrant')
+        self.assertEqual(Asset.objects.filter(project=self.project, asset_type=hydrant).count(), 2)
+
     def test_metadata_captures_extra_columns(self):
-        csv_file = make_csv_content(
+        self._import(
             [{'asset_id': 'M1', 'asset_type': 'T', 'x': '0', 'y': '0', 'name': '', 'depth': '3.5', 'material': 'steel'}],
             fieldnames=['asset_id', 'asset_type', 'x', 'y', 'name', 'depth', 'material'],
         )
-        import_assets_from_csv(self.project, csv_file)
-        a = Asset.objects.get(asset_id='M1')
-        self.assertEqual(a.metadata.get('depth'), '3.5')
-        self.assertEqual(a.metadata.get('material'), 'steel')
+        metadata = Asset.objects.values_list('metadata', flat=True).get(asset_id='M1')
+        self.assertEqual(metadata.get('depth'), '3.5')
+        self.assertEqual(metadata.get('material'), 'steel')
 
     def test_fixed_asset_type_import(self):
-        csv_file = make_csv_content(
+        result = self._import(
             [{'asset_id': 'F1', 'x': '1', 'y': '2', 'name': 'test'}],
             fieldnames=['asset_id', 'x', 'y', 'name'],
+            column_mapping={'asset_id': 'asset_id', 'x': 'x', 'y': 'y', 'name': 'name'},
+            fixed_asset_type='CCTV',
         )
-        result = import_assets_from_csv(self.project, csv_file,
-                                        column_mapping={'asset_id': 'asset_id', 'x': 'x', 'y': 'y', 'name': 'name'},
-                                        fixed_asset_type='CCTV')
         self.assertEqual(result['created'], 1)
-        a = Asset.objects.get(project=self.project, asset_id='F1')
-        self.assertEqual(a.asset_type.name, 'CCTV')
+        type_name = Asset.objects.values_list('asset_type__name', flat=True).get(project=self.project, asset_id='F1')
+        self.assertEqual(type_name, 'CCTV')
 
     def test_fixed_asset_type_creates_if_missing(self):
-        csv_file = make_csv_content(
+        result = self._import(
             [{'asset_id': 'F2', 'x': '3', 'y': '4', 'name': ''}],
             fieldnames=['asset_id', 'x', 'y', 'name'],
+            column_mapping={'asset_id': 'asset_id', 'x': 'x', 'y': 'y'},
+            fixed_asset_type='BrandNew',
         )
-        result = import_assets_from_csv(self.project, csv_file,
-                                        column_mapping={'asset_id': 'asset_id', 'x': 'x', 'y': 'y'},
-                                        fixed_asset_type='BrandNew')
         self.assertEqual(result['created'], 1)
         self.assertTrue(AssetType.objects.filter(name='BrandNew').exists())
 
     def test_fixed_asset_type_skips_column_validation(self):
-        csv_file = make_csv_content(
+        result = self._import(
             [{'asset_id': 'F3', 'x': '5', 'y': '6'}],
             fieldnames=['asset_id', 'x', 'y'],
+            column_mapping={'asset_id': 'asset_id', 'x': 'x', 'y': 'y'},
+            fixed_asset_type='VSL',
         )
-        result = import_assets_from_csv(self.project, csv_file,
-                                        column_mapping={'asset_id': 'asset_id', 'x': 'x', 'y': 'y'},
-                                        fixed_asset_type='VSL')
         self.assertEqual(result['created'], 1)
 
 
+@skipUnless(connection.vendor == 'postgresql', 'COPY upsert is only used on PostgreSQL')
+class PostgresCopyUpsertTests(TestCase):
+    """The COPY + INSERT ... ON CONFLICT write path, which SQLite runs never reach."""
+
+    FIELDNAMES = ['asset_id', 'asset_type', 'x', 'y', 'name', 'Zone', 'Note']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = create_project()
+
+    def _import(self, rows):
+        with patch('drawings.services.csv_importer._copy_upsert_postgresql',
+                   wraps=csv_importer._copy_upsert_postgresql) as copy_upsert:
+            result = import_assets_from_csv(self.project, make_csv_content(rows, self.FIELDNAMES))
+        copy_upsert.assert_called()
+        return result
+
+    def test_creates_then_updates(self):
+        result = self._import([
+            {'asset_id': 'P1', 'asset_type': 'Valve', 'x': '1', 'y': '2', 'name': 'First',
+             'Zone': 'North', 'Note': 'say "hi", ok'},
+            {'asset_id': 'P2', 'asset_type': 'Valve', 'x': '3', 'y': '4', 'name': ''},
+        ])
+        self.assertEqual((result['created'], result['updated']), (2, 0))
+
+        result = self._import([
+            {'asset_id': 'P1', 'asset_type': 'Pipe', 'x': '5', 'y': '6', 'name': 'Moved', 'Zone': 'South'},
+            {'asset_id': 'P3', 'asset_type': 'Pipe', 'x': '7', 'y': '8', 'name': 'Third'},
+        ])
+        self.assertEqual((result['created'], result['updated']), (1, 1))
+
+        moved = Asset.objects.get(project=self.project, asset_id='P1')
+        self.assertEqual((moved.original_x, moved.original_y, moved.name), (5.0, 6.0, 'Moved'))
+        self.assertEqual(moved.asset_type.name, 'Pipe')
+        self.assertEqual(moved.metadata, {'Zone': 'South'})
+        self.assertEqual(Asset.objects.filter(project=self.project).count(), 3)
+
+    def test_metadata_round_trips_as_jsonb(self):
+        self._import([
+            {'asset_id': 'J1', 'asset_type': 'Valve', 'x': '1', 'y': '2', 'name': 'J',
+             'Zone': 'Zürich', 'Note': 'say "hi", ok'},
+        ])
+        asset = Asset.objects.get(project=self.project, asset_id='J1')
+        self.assertEqual(asset.metadata, {'Zone': 'Zürich', 'Note': 'say "hi", ok'})
+        # Stored as a JSON object, not a JSON string holding the text
+        self.assertTrue(Asset.objects.filter(pk=asset.pk, metadata__Zone='Zürich').exists())
+
+    def test_empty_name_stays_empty_string(self):
+        self._import([{'asset_id': 'N1', 'asset_type': 'Valve', 'x': '1', 'y': '2', 'name': ''}])
+        self.assertEqual(Asset.objects.get(project=self.project, asset_id='N1').name, '')
+
+
 # ---------------------------------------------------------------------------
 # API tests
 # ---------------------------------------------------------------------------
 
-@override_settings(DEBUG=True)
-class ProjectAPITests(TestCase):
+class AuthenticatedAPITestCase(APITestCase):
+    """API tests run as a logged-in user with DEBUG off, as in production."""
+
     def setUp(self):
-        self.client = APIClient()
+        self.client.force_authenticate(User(username='tester'))
 
+
+class _ProjectFixture(AuthenticatedAPITestCase):
+    """Shares one project across the tests of a class."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = create_project()
+
+
+class _AssetTypeFixture(_ProjectFixture):
+    """Adds a shared asset type to the project fixture."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.asset_type = create_asset_type()
+
+
+class ProjectAPITests(AuthenticatedAPITestCase):
     def test_list_empty(self):
         resp = self.client.get('/api/projects/')
         self.assertEqual(resp.status_code, 200)
@@ -427,83 +707,49 @@ class ProjectAPITests(TestCase):
         self.assertFalse(Project.objects.filter(pk=p.pk).exists())
 
 
-@override_settings(DEBUG=True)
-class CalibrateAPITests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-        self.project = create_project()
+class CalibrateAPITests(_ProjectFixture):
+    SCALE_BODY = {'pixel_distance': 500, 'real_distance': 10}
+
+    def _calibrate(self, body):
+        return self.client.post(f'/api/projects/{self.project.pk}/calibrate/', body, format='json')
 
     def test_set_scale(self):
-        resp = self.client.post(
-            f'/api/projects/{self.project.pk}/calibrate/',
-            {'pixel_distance': 500, 'real_distance': 10},
-            format='json',
-        )
+        resp = self._calibrate(self.SCALE_BODY)
         self.assertEqual(resp.status_code, 200)
-        self.assertAlmostEqual(resp.json()['pixels_per_meter'], 50.0)
+        self.assertEqual(resp.json()['pixels_per_meter'], 50.0)
 
     def test_set_origin(self):
-        resp = self.client.post(
-            f'/api/projects/{self.project.pk}/calibrate/',
-            {'origin_x': 100, 'origin_y': 200},
-            format='json',
-        )
+        resp = self._calibrate({'origin_x': 100, 'origin_y': 200})
         self.assertEqual(resp.status_code, 200)
-        self.project.refresh_from_db()
-        self.assertEqual(self.project.origin_x, 100.0)
+        self.assertEqual(resp.json()['origin_x'], 100.0)
 
     def test_set_rotation(self):
-        resp = self.client.post(
-            f'/api/projects/{self.project.pk}/calibrate/',
-            {'canvas_rotation': 45.0},
-            format='json',
-        )
+        resp = self._calibrate({'canvas_rotation': 45.0})
         self.assertEqual(resp.status_code, 200)
-        self.project.refresh_from_db()
-        self.assertEqual(self.project.canvas_rotation, 45.0)
+        self.assertEqual(resp.json()['canvas_rotation'], 45.0)
 
     def test_set_asset_calibration(self):
-        resp = self.client.post(
-            f'/api/projects/{self.project.pk}/calibrate/',
-            {'asset_rotation': 12.5, 'ref_asset_id': 'REF1', 'ref_pixel_x': 300, 'ref_pixel_y': 400},
-            format='json',
-        )
+        resp = self._calibrate({'asset_rotation': 12.5, 'ref_asset_id': 'REF1', 'ref_pixel_x': 300, 'ref_pixel_y': 400})
         self.assertEqual(resp.status_code, 200)
-        self.project.refresh_from_db()
-        self.assertEqual(self.project.asset_rotation, 12.5)
-        self.assertEqual(self.project.ref_asset_id, 'REF1')
+        data = resp.json()
+        self.assertEqual(data['asset_rotation'], 12.5)
+        self.assertEqual(data['ref_asset_id'], 'REF1')
 
     def test_invalid_real_distance(self):
-        resp = self.client.post(
-            f'/api/projects/{self.project.pk}/calibrate/',
-            {'pixel_distance': 500, 'real_distance': 0},
-            format='json',
-        )
+        resp = self._calibrate({'pixel_distance': 500, 'real_distance': 0})
         self.assertEqual(resp.status_code, 400)
 
     def test_non_finite_value_rejected(self):
-        resp = self.client.post(
-            f'/api/projects/{self.project.pk}/calibrate/',
-            {'origin_x': 'inf'},
-            format='json',
-        )
+        resp = self._calibrate({'origin_x': 'inf'})
         self.assertEqual(resp.status_code, 400)
 
     def test_non_numeric_value_rejected(self):
-        resp = self.client.post(
-            f'/api/projects/{self.project.pk}/calibrate/',
-            {'origin_x': 'abc'},
-            format='json',
-        )
+        resp = self._calibrate({'origin_x': 'abc'})
         self.assertEqual(resp.status_code, 400)
 
     def test_scale_calibrated_set_on_calibration(self):
         self.assertFalse(self.project.scale_calibrated)
-        resp = self.client.post(
-            f'/api/projects/{self.project.pk}/calibrate/',
-            {'pixel_distance': 500, 'real_distance': 10},
-            format='json',
-        )
+        resp = self._calibrate(self.SCALE_BODY)
         self.assertEqual(resp.status_code, 200)
         self.assertTrue(resp.json().get('scale_calibrated'))
         self.project.refresh_from_db()
@@ -519,52 +765,26 @@ class CalibrateAPITests(TestCase):
         self.assertEqual(data['coord_unit'], 'meters')
 
     def test_set_coord_unit(self):
-        resp = self.client.post(
-            f'/api/projects/{self.project.pk}/calibrate/',
-            {'coord_unit': 'degrees'},
-            format='json',
-        )
+        resp = self._calibrate({'coord_unit': 'degrees'})
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(resp.json()['coord_unit'], 'degrees')
-        self.project.refresh_from_db()
-        self.assertEqual(self.project.coord_unit, 'degrees')
 
     def test_invalid_coord_unit_rejected(self):
-        resp = self.client.post(
-            f'/api/projects/{self.project.pk}/calibrate/',
-            {'coord_unit': 'invalid'},
-            format='json',
-        )
+        resp = self._calibrate({'coord_unit': 'invalid'})
         self.assertEqual(resp.status_code, 400)
 
     def test_set_gda94_geo_coord_unit(self):
-        resp = self.client.post(
-            f'/api/projects/{self.project.pk}/calibrate/',
-            {'coord_unit': 'gda94_geo'},
-            format='json',
-        )
+        resp = self._calibrate({'coord_unit': 'gda94_geo'})
         self.assertEqual(resp.status_code, 200)
-        self.project.refresh_from_db()
-        self.assertEqual(self.project.coord_unit, 'gda94_geo')
+        self.assertEqual(resp.json()['coord_unit'], 'gda94_geo')
 
     def test_set_gda94_mga_coord_unit(self):
-        resp = self.client.post(
-            f'/api/projects/{self.project.pk}/calibrate/',
-            {'coord_unit': 'gda94_mga'},
-            format='json',
-        )
+        resp = self._calibrate({'coord_unit': 'gda94_mga'})
         self.assertEqual(resp.status_code, 200)
-        self.project.refresh_from_db()
-        self.assertEqual(self.project.coord_unit, 'gda94_mga')
-
+        self.assertEqual(resp.json()['coord_unit'], 'gda94_mga')
 
-@override_settings(DEBUG=True)
-class AssetAPITests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-        self.project = create_project()
-        self.asset_type = create_asset_type()
 
+class AssetAPITests(_AssetTypeFixture):
     def test_list(self):
         Asset.objects.create(
             project=self.project, asset_type=self.asset_type,
@@ -600,14 +820,12 @@ class AssetAPITests(TestCase):
         self.assertEqual(resp.status_code, 204)
 
 
-@override_settings(DEBUG=True)
-class AdjustAssetAPITests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-        self.project = create_project()
-        self.asset_type = create_asset_type()
-        self.asset = Asset.objects.create(
-            project=self.project, asset_type=self.asset_type,
+class AdjustAssetAPITests(_AssetTypeFixture):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.asset = Asset.objects.create(
+            project=cls.project, asset_type=cls.asset_type,
             asset_id='ADJ1', original_x=10, original_y=20,
         )
 
@@ -620,7 +838,7 @@ class AdjustAssetAPITests(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.asset.refresh_from_db()
         self.assertTrue(self.asset.is_adjusted)
-        self.assertAlmostEqual(self.asset.adjusted_x, 13.0)
+        self.assertEqual(self.asset.adjusted_x, 13.0)
         self.assertEqual(AdjustmentLog.objects.count(), 1)
 
     def test_adjust_missing_coords(self):
@@ -632,12 +850,7 @@ class AdjustAssetAPITests(TestCase):
         self.assertEqual(resp.status_code, 400)
 
 
-@override_settings(DEBUG=True)
-class ImportCSVAPITests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-        self.project = create_project()
-
+class ImportCSVAPITests(_ProjectFixture):
     def test_import_csv(self):
         csv_file = make_csv_content([
             {'asset_id': 'I1', 'asset_type': 'Pump', 'x': '1', 'y': '2', 'name': 'P1'},
@@ -651,7 +864,6 @@ class ImportCSVAPITests(TestCase):
         self.assertEqual(resp.json()['created'], 1)
 
     def test_import_with_mapping(self):
-        import json
         csv_file = make_csv_content(
             [{'TN': 'M1', 'Type': 'Pipe', 'E': '5', 'N': '6', 'Desc': 'test'}],
             fieldnames=['TN', 'Type', 'E', 'N', 'Desc'],
@@ -669,6 +881,51 @@ class ImportCSVAPITests(TestCase):
         self.assertEqual(resp.json()['created'], 1)
         self.assertTrue(Asset.objects.filter(asset_id='M1').exists())
 
+    @patch('drawings.services.csv_importer.BATCH_SIZE', 2)
+    def test_invalid_values_in_later_batch_keep_valid_rows(self):
+        rows = [{'asset_id': f'G{i}', 'asset_type': 'Pump', 'x': str(i), 'y': '0', 'name': ''} for i in range(5)]
+        rows += [
+            {'asset_id': 'NAN', 'asset_type': 'Pump', 'x': 'nan', 'y': '0', 'name': ''},
+            {'asset_id': 'X' * 101, 'asset_type': 'Pump', 'x': '1', 'y': '0', 'name': ''},
+            {'asset_id': 'G5', 'asset_type': 'Pump', 'x': '5', 'y': '0', 'name': ''},
+        ]
+        resp = self.client.post(
+            f'/api/projects/{self.project.pk}/import-csv/',
+            {'file': make_csv_content(rows)},
+            format='multipart',
+        )
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(data['created'], 6)
+        self.assertEqual(len(data['errors']), 2)
+        self.assertEqual(ImportBatch.objects.get(project=self.project).asset_count, 6)
+
+    @patch('drawings.services.csv_importer.BATCH_SIZE', 2)
+    def test_write_failure_reports_stored_rows(self):
+        csv_file = make_csv_content([
+            {'asset_id': f'W{i}', 'asset_type': 'Pump', 'x': str(i), 'y': '0', 'name': ''}
+            for i in range(3)
+        ])
+        bulk_create = Asset.objects.bulk_create
+        calls = []
+
+        def fail_second_batch(objs, **kwargs):
+            calls.append(len(objs))
+            if len(calls) > 1:
+                raise DatabaseError('disk full')
+            return bulk_create(objs, **kwargs)
+
+        with patch.object(Asset.objects, 'bulk_create', side_effect=fail_second_batch):
+            resp = self.client.post(
+                f'/api/projects/{self.project.pk}/import-csv/',
+                {'file': csv_file},
+                format='multipart',
+            )
+        self.assertEqual(resp.status_code, 500)
+        data = resp.json()
+        self.assertEqual(data['created'], 2)
+        self.assertEqual(ImportBatch.objects.get(pk=data['batch_id']).asset_count, 2)
+
     def test_no_file(self):
         resp = self.client.post(
             f'/api/projects/{self.project.pk}/import-csv/',
@@ -678,68 +935,56 @@ class ImportCSVAPITests(TestCase):
         self.assertEqual(resp.status_code, 400)
 
 
-@override_settings(DEBUG=True)
-class ImportBatchAPITests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-        self.project = create_project()
-        self.asset_type = create_asset_type()
+class ImportBatchAPITests(_AssetTypeFixture):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Each test's transaction is rolled back, so destructive tests can share this graph
+        cls.batch = ImportBatch.objects.create(project=cls.project, filename='f.csv', asset_count=2)
+        Asset.objects.bulk_create([
+            Asset(project=cls.project, asset_type=cls.asset_type,
+                  asset_id='BA1', original_x=0, original_y=0, import_batch=cls.batch),
+            Asset(project=cls.project, asset_type=cls.asset_type,
+                  asset_id='BA2', original_x=1, original_y=1, import_batch=cls.batch),
+        ])
 
     def test_list_batches(self):
-        batch = ImportBatch.objects.create(project=self.project, filename='f.csv', asset_count=2)
         resp = self.client.get(f'/api/projects/{self.project.pk}/import-batches/')
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(len(resp.json()), 1)
 
     def test_delete_batch_cascades(self):
-        batch = ImportBatch.objects.create(project=self.project, filename='f.csv', asset_count=1)
-        Asset.objects.create(
-            project=self.project, asset_type=self.asset_type,
-            asset_id='BA1', original_x=0, original_y=0, import_batch=batch,
-        )
-        resp = self.client.delete(f'/api/import-batches/{batch.pk}/')
+        resp = self.client.delete(f'/api/import-batches/{self.batch.pk}/')
         self.assertEqual(resp.status_code, 204)
-        self.assertFalse(Asset.objects.filter(asset_id='BA1').exists())
-        self.assertFalse(ImportBatch.objects.filter(pk=batch.pk).exists())
+        self.assertFalse(Asset.objects.filter(asset_id__in=['BA1', 'BA2']).exists())
+        self.assertFalse(ImportBatch.objects.filter(pk=self.batch.pk).exists())
 
     def test_reassign_batch_asset_type(self):
-        batch = ImportBatch.objects.create(project=self.project, filename='r.csv', asset_count=2)
-        Asset.objects.create(
-            project=self.project, asset_type=self.asset_type,
-            asset_id='RA1', original_x=0, original_y=0, import_batch=batch,
-        )
-        Asset.objects.create(
-            project=self.project, asset_type=self.asset_type,
-            asset_id='RA2', original_x=1, original_y=1, import_batch=batch,
-        )
         resp = self.client.patch(
-            f'/api/import-batches/{batch.pk}/',
+            f'/api/import-batches/{self.batch.pk}/',
             {'asset_type_name': 'NewType'},
             format='json',
         )
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(resp.json()['updated'], 2)
         new_type = AssetType.objects.get(name='NewType')
-        self.assertTrue(Asset.objects.filter(import_batch=batch, asset_type=new_type).count() == 2)
+        self.assertTrue(Asset.objects.filter(import_batch=self.batch, asset_type=new_type).count() == 2)
 
     def test_reassign_batch_missing_name(self):
-        batch = ImportBatch.objects.create(project=self.project, filename='r2.csv', asset_count=0)
         resp = self.client.patch(
-            f'/api/import-batches/{batch.pk}/',
+            f'/api/import-batches/{self.batch.pk}/',
             {'asset_type_name': ''},
             format='json',
         )
         self.assertEqual(resp.status_code, 400)
 
 
-@override_settings(DEBUG=True)
-class ColumnPresetsAPITests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-
+class ColumnPresetsAPITests(AuthenticatedAPITestCase):
     def test_list_presets(self):
-        ColumnPreset.objects.create(role='asset_id', column_name='SerialNum', priority=10)
-        ColumnPreset.objects.create(role='x', column_name='Lon', priority=0)
+        ColumnPreset.objects.bulk_create([
+            ColumnPreset(role='asset_id', column_name='SerialNum', priority=10),
+            ColumnPreset(role='x', column_name='Lon', priority=0),
+        ])
         resp = self.client.get('/api/column-presets/')
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
@@ -747,15 +992,20 @@ class ColumnPresetsAPITests(TestCase):
         self.assertIn('SerialNum', data['asset_id'])
 
 
-@override_settings(DEBUG=True)
-class SheetAPITests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-        self.project = create_project()
-
-    @patch('drawings.api_views.render_pdf_page')
-    @patch('drawings.api_views.get_pdf_page_count', return_value=1)
-    def test_create_sheet(self, mock_count, mock_render):
+class SheetAPITests(_ProjectFixture):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # No test here looks at the rendered page, so keep PyMuPDF out of the whole class
+        for target, kwargs in (
+            ('drawings.api_views.render_pdf_page', {}),
+            ('drawings.api_views.get_pdf_page_count', {'return_value': 1}),
+        ):
+            patcher = patch(target, **kwargs)
+            patcher.start()
+            cls.addClassCleanup(patcher.stop)
+
+    def test_create_sheet(self):
         pdf = make_pdf_file()
         resp = self.client.post(
             f'/api/projects/{self.project.pk}/sheets/',
@@ -804,12 +1054,7 @@ class SheetAPITests(TestCase):
         self.assertEqual(resp.status_code, 204)
 
 
-@override_settings(DEBUG=True)
-class SplitSheetAPITests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-        self.project = create_project()
-
+class SplitSheetAPITests(_ProjectFixture):
     @patch('drawings.api_views.render_pdf_page')
     def test_split(self, mock_render):
         s = Sheet.objects.create(project=self.project, name='ToSplit', pdf_file=make_pdf_file())
@@ -838,13 +1083,7 @@ class SplitSheetAPITests(TestCase):
         self.assertEqual(resp.status_code, 400)
 
 
-@override_settings(DEBUG=True)
-class AdjustmentReportAPITests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-        self.project = create_project()
-        self.asset_type = create_asset_type()
-
+class AdjustmentReportAPITests(_AssetTypeFixture):
     def test_empty_report(self):
         resp = self.client.get(f'/api/projects/{self.project.pk}/adjustment-report/')
         self.assertEqual(resp.status_code, 200)
@@ -864,6 +1103,29 @@ class AdjustmentReportAPITests(TestCase):
         self.assertEqual(data['adjusted_count'], 1)
         self.assertEqual(len(data['summary']), 1)
 
+    def test_report_queries_do_not_grow_with_assets(self):
+        from .services.export_service import generate_adjustment_report
+
+        for i in range(3):
+            a = Asset.objects.create(
+                project=self.project, asset_type=self.asset_type,
+                asset_id=f'Q{i}', original_x=0, original_y=0,
+                adjusted_x=3, adjusted_y=4, is_adjusted=True,
+            )
+            AdjustmentLog.objects.create(asset=a, from_x=0, from_y=0, to_x=1, to_y=1)
+            AdjustmentLog.objects.create(asset=a, from_x=1, from_y=1, to_x=3, to_y=4)
+        with self.assertNumQueries(5):
+            resp = self.client.get(f'/api/projects/{self.project.pk}/adjustment-report/')
+        summary = resp.json()['summary']
+        self.assertEqual([row['adjustment_count'] for row in summary], [2, 2, 2])
+
+        adjusted = self.project.assets.filter(is_adjusted=True)
+        logs = AdjustmentLog.objects.filter(asset__project=self.project)
+        resp = generate_adjustment_report(self.project, adjusted, logs, format_type='csv')
+        with self.assertNumQueries(2):
+            content = b''.join(resp.streaming_content).decode('utf-8')
+        self.assertIn('Q2', content)
+
     def test_csv_format(self):
         """Test CSV report generation via the service function directly.
 
@@ -884,23 +1146,27 @@ class AdjustmentReportAPITests(TestCase):
         resp = generate_adjustment_report(self.project, adjusted, logs, format_type='csv')
 
         self.assertEqual(resp['Content-Type'], 'text/csv')
-        content = resp.content.decode('utf-8')
+        content = b''.join(resp.streaming_content).decode('utf-8')
         self.assertIn('C1', content)
         self.assertIn('Asset ID', content)
 
+    def test_csv_rows_streamed_in_chunks(self):
+        from .services.export_service import _csv_chunks
+
+        chunks = list(_csv_chunks([['h'], ['1'], ['2'], ['3']], chunk_size=2))
+        self.assertEqual(chunks, ['h\r\n1\r\n', '2\r\n3\r\n'])
+
 
 # ---------------------------------------------------------------------------
 # adjust_asset input validation tests
 # ---------------------------------------------------------------------------
 
-@override_settings(DEBUG=True)
-class AdjustAssetValidationTests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-        self.project = create_project()
-        self.asset_type = create_asset_type()
-        self.asset = Asset.objects.create(
-            project=self.project, asset_type=self.asset_type,
+class AdjustAssetValidationTests(_AssetTypeFixture):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.asset = Asset.objects.create(
+            project=cls.project, asset_type=cls.asset_type,
             asset_id='VAL1', original_x=10, original_y=20,
         )
 
@@ -933,12 +1199,7 @@ class AdjustAssetValidationTests(TestCase):
 # render_sheet endpoint tests
 # ---------------------------------------------------------------------------
 
-@override_settings(DEBUG=True)
-class RenderSheetAPITests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-        self.project = create_project()
-
+class RenderSheetAPITests(_ProjectFixture):
     @patch('drawings.api_views.render_pdf_page')
     def test_render_sheet_success(self, mock_render):
         s = Sheet.objects.create(project=self.project, name='Render', pdf_file=make_pdf_file())
@@ -967,15 +1228,95 @@ class RenderSheetAPITests(TestCase):
 
 
 # ---------------------------------------------------------------------------
-# export_project endpoint tests
+# Render cache tests
 # ---------------------------------------------------------------------------
 
-@override_settings(DEBUG=True)
-class ExportProjectAPITests(TestCase):
+class RenderCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = create_project()
+        doc = fitz.open()
+        doc.new_page(width=144, height=72)
+        cls.pdf_bytes = doc.tobytes()
+        doc.close()
+
     def setUp(self):
-        self.client = APIClient()
-        self.project = create_project()
+        # Each test starts from an empty cache in its own media root
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _sheet(self, name):
+        pdf = SimpleUploadedFile(f'{name}.pdf', self.pdf_bytes, content_type='application/pdf')
+        return Sheet.objects.create(project=self.project, name=name, pdf_file=pdf)
+
+    def test_pdf_hashed_once_for_all_its_pages(self):
+        from .services import pdf_processor
+
+        doc = fitz.open()
+        for _ in range(3):
+            doc.new_page(width=144, height=72)
+        pdf = SimpleUploadedFile('multi.pdf', doc.tobytes(), content_type='application/pdf')
+        doc.close()
+        first = Sheet.objects.create(project=self.project, name='M-1', pdf_file=pdf)
+        sheets = [first] + [
+            Sheet.objects.create(project=self.project, name=f'M-{n}', pdf_file=first.pdf_file, page_number=n)
+            for n in (2, 3)
+        ]
+        pdf_processor._file_digest.cache_clear()
+        for sheet in sheets:
+            pdf_processor.render_pdf_page(sheet)
+        self.assertEqual(pdf_processor._file_digest.cache_info().misses, 1)
+
+    def test_rewrite_replaces_entry_in_place(self):
+        from django.core.files.storage import default_storage
+        from .services import pdf_processor
+
+        sheet = self._sheet('Again')
+        pdf_processor.render_pdf_page(sheet)
+        cache_name = pdf_processor.render_cache_name(sheet.pdf_file.path, sheet.page_number, 150)
+        # As a concurrent render of the same page would
+        pdf_processor._write_cache_entry(cache_name, b'png')
+        self.assertEqual(default_storage.listdir(pdf_processor.RENDER_CACHE_DIR)[1],
+                         [os.path.basename(cache_name)])
+
+    def test_pruned_entry_is_rendered_again(self):
+        from .services import pdf_processor
+
+        pdf_processor.render_pdf_page(self._sheet('First'))
+        call_command('prune_render_cache', keep=0, stdout=io.StringIO())
+        with patch.object(pdf_processor, '_rasterize_page', wraps=pdf_processor._rasterize_page) as rasterize:
+            result = pdf_processor.render_pdf_page(self._sheet('Second'))
+        rasterize.assert_called_once()
+        self.assertEqual((result['width'], result['height']), (300, 150))
+
+    def test_same_page_rendered_once(self):
+        from .services import pdf_processor
+
+        first = pdf_processor.render_pdf_page(self._sheet('First'))
+        with patch.object(pdf_processor, '_rasterize_page') as mock_rasterize:
+            second = pdf_processor.render_pdf_page(self._sheet('Second'))
+        mock_rasterize.assert_not_called()
+        self.assertEqual((second['width'], second['height']), (first['width'], first['height']))
+
+    def test_prune_keeps_newest(self):
+        from django.core.files.storage import default_storage
+        from .services.pdf_processor import RENDER_CACHE_DIR
+
+        for age, name in enumerate(['new', 'mid', 'old']):
+            path = default_storage.path(default_storage.save(f'{RENDER_CACHE_DIR}/{name}.png', io.BytesIO(b'png')))
+            os.utime(path, (1_000_000 - age, 1_000_000 - age))
+        call_command('prune_render_cache', keep=1, stdout=io.StringIO())
+        self.assertEqual(default_storage.listdir(RENDER_CACHE_DIR)[1], ['new.png'])
+
 
+# ---------------------------------------------------------------------------
+# export_project endpoint tests
+# ---------------------------------------------------------------------------
+
+class ExportProjectAPITests(_ProjectFixture):
     @patch('drawings.api_views.export_sheet_with_overlays', return_value='exports/test.pdf')
     def test_export_project_success(self, mock_export):
         Sheet.objects.create(project=self.project, name='E1', pdf_file=make_pdf_file())
@@ -1000,6 +1341,15 @@ class ExportProjectAPITests(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(len(resp.json()['exports']), 1)
 
+    @patch('drawings.api_views.export_sheet_with_overlays', return_value='exports/test.pdf')
+    def test_export_loads_assets_once(self, mock_export):
+        Sheet.objects.create(project=self.project, name='E1', pdf_file=make_pdf_file())
+        Sheet.objects.create(project=self.project, name='E2', pdf_file=make_pdf_file())
+        resp = self.client.post(f'/api/projects/{self.project.pk}/export/', {}, format='json')
+        self.assertEqual(resp.status_code, 200)
+        (_, first_assets), (_, second_assets) = (c.args for c in mock_export.call_args_list)
+        self.assertIs(first_assets, second_assets)
+
     def test_export_empty_project(self):
         resp = self.client.post(
             f'/api/projects/{self.project.pk}/export/',
@@ -1033,7 +1383,7 @@ class CsvFormulaInjectionTests(TestCase):
         adjusted = p.assets.filter(is_adjusted=True)
         logs = AdjustmentLog.objects.filter(asset__project=p)
         resp = generate_adjustment_report(p, adjusted, logs, format_type='csv')
-        content = resp.content.decode('utf-8')
+        content = b''.join(resp.streaming_content).decode('utf-8')
 
         # All formula-like values should be prefixed with '
         self.assertIn("'=1+1", content)
@@ -1057,7 +1407,7 @@ class CsvFormulaInjectionTests(TestCase):
 # parse_color tests
 # ---------------------------------------------------------------------------
 
-class ParseColorTests(TestCase):
+class ParseColorTests(SimpleTestCase):
     def test_valid_hex_with_hash(self):
         from .services.pdf_processor import parse_color
         self.assertEqual(parse_color('#FF0000'), (1.0, 0.0, 0.0))
@@ -1072,16 +1422,18 @@ class ParseColorTests(TestCase):
         self.assertEqual(parse_color(''), (1.0, 0.0, 0.0))
         self.assertEqual(parse_color('#AB'), (1.0, 0.0, 0.0))
 
+    def test_non_hex_characters_return_default(self):
+        from .services.pdf_processor import parse_color
+        self.assertEqual(parse_color('#12_345'), (1.0, 0.0, 0.0))
+        self.assertEqual(parse_color('#-F0000'), (1.0, 0.0, 0.0))
+
 
 # ---------------------------------------------------------------------------
 # Auth/Permission tests (DEBUG=False)
 # ---------------------------------------------------------------------------
 
 @override_settings(DEBUG=False)
-class AuthPermissionTests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-
+class AuthPermissionTests(APITestCase):
     def test_project_list_requires_auth(self):
         resp = self.client.get('/api/projects/')
         self.assertIn(resp.status_code, [401, 403])
@@ -1108,16 +1460,27 @@ class AuthPermissionTests(TestCase):
         self.assertIn(resp.status_code, [401, 403])
 
 
+class DebugSettingPermissionTests(APITestCase):
+    """No override_settings: DEBUG is whatever the test runner assigned."""
+
+    def test_unauthenticated_denied_by_default(self):
+        # The runner forces DEBUG=False whatever DJANGO_DEBUG says
+        resp = self.client.get('/api/projects/')
+        self.assertIn(resp.status_code, [401, 403])
+
+    def test_debug_assigned_directly_is_honoured(self):
+        # Plain assignment sends no setting_changed signal
+        self.addCleanup(setattr, settings, 'DEBUG', settings.DEBUG)
+        settings.DEBUG = True
+        resp = self.client.get('/api/projects/')
+        self.assertEqual(resp.status_code, 200)
+
+
 # ---------------------------------------------------------------------------
 # Edge case tests
 # ---------------------------------------------------------------------------
 
-@override_settings(DEBUG=True)
-class EdgeCaseTests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-        self.project = create_project()
-
+class EdgeCaseTests(_ProjectFixture):
     def test_import_csv_empty_file(self):
         """CSV with headers but no data rows should import 0 assets."""
         csv_file = make_csv_content(
@@ -1137,8 +1500,9 @@ class EdgeCaseTests(TestCase):
             {'cuts_json': cuts},
             format='json',
         )
-        # Documents current behavior: serializer validates structure but not numeric types
-        self.assertEqual(resp.status_code, 200)
+        # Coordinates must be JSON numbers, so stored cuts never need float coercion
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('cuts_json', resp.json())
 
     @patch('drawings.api_views.render_pdf_page')
     def test_split_out_of_bounds(self, mock_render):
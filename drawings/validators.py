@@ -2,13 +2,68 @@
 from django.core.exceptions import ValidationError
 from django.utils.deconstruct import deconstructible
 
-# python-magic is optional - provides enhanced MIME type detection
+# python-magic is optional - provides enhanced MIME type detection.
+# One detector is built at import so its magic database is loaded only once.
 try:
     import magic
+    _MAGIC = magic.Magic(mime=True)
     HAS_MAGIC = True
-except ImportError:
+except Exception:
+    # Not installed, or libmagic / its database is missing: use the header checks
     HAS_MAGIC = False
 
+PDF_SIGNATURE = b'%PDF-'
+
+# Leading bytes of the image formats accepted without python-magic
+IMAGE_SIGNATURES = (
+    b'\x89PNG',            # PNG
+    b'\xff\xd8\xff',      # JPEG
+    b'GIF87a', b'GIF89a',  # GIF
+)
+
+# Complete signatures that settle the type for a matching extension without libmagic
+UNAMBIGUOUS_IMAGE_SIGNATURES = {
+    '.png': (b'\x89PNG\r\n\x1a\n',),
+    '.jpg': (b'\xff\xd8\xff',),
+    '.jpeg': (b'\xff\xd8\xff',),
+    '.gif': (b'GIF87a', b'GIF89a'),
+}
+
+
+def read_header(file, size):
+    """
+    Return the first `size` bytes of an uploaded file, leaving it at position 0.
+
+    The bytes read are remembered on the file object, so a later validator
+    asking for the same or a shorter header does not read the file again.
+    """
+    cached = getattr(file, '_sniffed_header', None)
+    if cached is not None and cached[0] >= size:
+        return cached[1][:size]
+    header = _peek(file, size)
+    if header is None:
+        file.seek(0)
+        header = file.read(size)
+        file.seek(0)
+    file._sniffed_header = (size, header)
+    return header
+
+
+def _peek(file, size):
+    """
+    Read the header from a buffered stream's peek() without moving it.
+
+    Uploads spooled to disk wrap a buffered file that supports this. Returns
+    None when peeking cannot give the full header from position 0.
+    """
+    stream = getattr(file, 'file', file)
+    peek = getattr(stream, 'peek', None)
+    if peek is None or stream.tell() != 0:
+        return None
+    data = peek(size)
+    # peek() returns whatever is buffered, which may be short of `size`
+    return data[:size] if len(data) >= size else None
+
 
 @deconstructible
 class PDFFileValidator:
@@ -36,21 +91,18 @@ class PDFFileValidator:
         if not file.name.lower().endswith('.pdf'):
             raise ValidationError('File must have a .pdf extension.')
 
-        # Check actual file content using magic bytes
-        file.seek(0)
-        file_header = file.read(2048)
-        file.seek(0)
-
-        # Check PDF magic bytes (PDF files start with %PDF-)
-        if not file_header.startswith(b'%PDF-'):
+        # Check PDF magic bytes (PDF files start with %PDF-); the signature is
+        # all that is needed, so only read that much
+        if read_header(file, len(PDF_SIGNATURE)) != PDF_SIGNATURE:
             raise ValidationError(
                 'Invalid PDF file. The file content does not match PDF format.'
             )
 
         # Additional check using python-magic if available
         if HAS_MAGIC:
+            file_header = read_header(file, 1024)  # Enough for libmagic to identify a PDF
             try:
-                mime_type = magic.from_buffer(file_header, mime=True)
+                mime_type = _MAGIC.from_buffer(file_header)
                 if mime_type not in self.allowed_mime_types:
                     raise ValidationError(
                         f'Invalid file type: {mime_type}. Only PDF files are allowed.'
@@ -95,13 +147,13 @@ class ImageFileValidator:
             )
 
         # Check actual file content using magic bytes
-        file.seek(0)
-        file_header = file.read(2048)
-        file.seek(0)
+        file_header = read_header(file, 2048)
+        if file_header.startswith(UNAMBIGUOUS_IMAGE_SIGNATURES.get(ext, ())):
+            return
 
         if HAS_MAGIC:
             try:
-                mime_type = magic.from_buffer(file_header, mime=True)
+                mime_type = _MAGIC.from_buffer(file_header)
                 if mime_type not in self.allowed_mime_types:
                     raise ValidationError(
                         f'Invalid file type: {mime_type}. Only image files are allowed.'
@@ -111,14 +163,8 @@ class ImageFileValidator:
                 pass  # Fall through to basic header checks
 
         # Basic header checks (fallback when magic is unavailable or fails)
-        # PNG: starts with \x89PNG
-        # JPEG: starts with \xff\xd8\xff
-        # GIF: starts with GIF87a or GIF89a
-        is_png = file_header.startswith(b'\x89PNG')
-        is_jpeg = file_header.startswith(b'\xff\xd8\xff')
-        is_gif = file_header.startswith(b'GIF87a') or file_header.startswith(b'GIF89a')
-
-        if not (is_png or is_jpeg or is_gif):
+        is_webp = file_header[:4] == b'RIFF' and file_header[8:12] == b'WEBP'
+        if not (file_header.startswith(IMAGE_SIGNATURES) or is_webp):
             raise ValidationError(
                 'Invalid image file. The file content does not match expected image format.'
             )